@@ -1,16 +1,31 @@
-import json
+import logging
 import os
 import re
-from datetime import datetime
+import sys
+import time
 
-import pandas as pd
 import streamlit as st
-from github_kv import read_json, write_json
+import github_kv
+import local_cache
+import picker
+import store
+from github_kv import ReadError
+from decks import DeckCatalog
+from local_cache import DATA_DIR
+from oplog import OpLog
+from ranking import count_by, rank, remap
+
+# 再実行ごとの処理時間（TRACKER_TIMINGS=1 で表示）
+_T0 = time.perf_counter()
+SHOW_TIMINGS = os.environ.get("TRACKER_TIMINGS") == "1"
+_timing_log = logging.getLogger("tracker.timings")
+if SHOW_TIMINGS and not _timing_log.handlers:  # スクリプトは再実行ごとに読み直されるので1回だけ
+    _timing_log.setLevel(logging.INFO)
+    _timing_log.addHandler(logging.StreamHandler())
 
 # =============================
 # 永続化（ユーザー別）
 # =============================
-DATA_DIR = "data"
 os.makedirs(DATA_DIR, exist_ok=True)
 
 
@@ -25,8 +40,7 @@ def sanitize_user_id(s: str) -> str:
 
 def user_data_path(user_id: str) -> str:
     # GitHub上のパス
-    data_dir = st.secrets.get("GITHUB_DATA_DIR", "data").strip("/")
-    return f"{data_dir}/tracker_{user_id}.json"
+    return store.user_data_path(user_id, st.secrets.get("GITHUB_DATA_DIR", "data"))
 
 
 # =============================
@@ -43,36 +57,6 @@ CLASS_COLORS = {
 }
 CLASS_ORDER = ["E", "R", "D", "W", "Ni", "B", "Nm"]
 
-INITIAL_DECKS = [
-    {"name": "リノE", "class": "E"},
-    {"name": "テンポE", "class": "E"},
-    {"name": "進化E", "class": "E"},
-    {"name": "不殺E", "class": "E"},
-    {"name": "財宝R", "class": "R"},
-    {"name": "進化R", "class": "R"},
-    {"name": "オルオーンR", "class": "R"},
-    {"name": "ほーちゃんD", "class": "D"},
-    {"name": "進化D", "class": "D"},
-    {"name": "ランプD", "class": "D"},
-    {"name": "海洋D", "class": "D"},
-    {"name": "スペル秘術W", "class": "W"},
-    {"name": "秘術W", "class": "W"},
-    {"name": "スペルW", "class": "W"},
-    {"name": "リンクルW", "class": "W"},
-    {"name": "リアニメイトNi", "class": "Ni"},
-    {"name": "モードNi", "class": "Ni"},
-    {"name": "ミルティオNi", "class": "Ni"},
-    {"name": "進化Ni", "class": "Ni"},
-    {"name": "ミッドレンジNi", "class": "Ni"},
-    {"name": "シャクドウNi", "class": "Ni"},
-    {"name": "アグロNi", "class": "Ni"},
-    {"name": "奇数B", "class": "B"},
-    {"name": "クレストB", "class": "B"},
-    {"name": "守護B", "class": "B"},
-    {"name": "破壊Nm", "class": "Nm"},
-    {"name": "人形Nm", "class": "Nm"},
-    {"name": "アーティファクトNm", "class": "Nm"},
-]
 
 
 
@@ -81,83 +65,120 @@ if "user_id" not in st.session_state:
     st.session_state.user_id = ""
 if "user_id_raw" not in st.session_state:
     st.session_state.user_id_raw = ""
-if "deck_types" not in st.session_state:
-    st.session_state.deck_types = INITIAL_DECKS
+else:
+    # 集計ビューでは入力欄が描画されないので、ウィジェットの値を保持し直す
+    st.session_state.user_id_raw = st.session_state.user_id_raw
+# ピッカーの検索語・開いているクラスも同様
+for _k in ("my_q", "my_cls", "opp_q", "opp_cls"):
+    if _k in st.session_state:
+        st.session_state[_k] = st.session_state[_k]
+if "catalog" not in st.session_state:
+    st.session_state.catalog = DeckCatalog()
 if "my_deck" not in st.session_state:
-    st.session_state.my_deck = ""
+    st.session_state.my_deck = None  # deck id
 if "current_opponent" not in st.session_state:
-    st.session_state.current_opponent = ""
+    st.session_state.current_opponent = None  # deck id
 if "matches" not in st.session_state:
-    st.session_state.matches = []
+    st.session_state.matches = []  # 古い順（末尾が最新）
+if "matches_version" not in st.session_state:
+    st.session_state.matches_version = 0  # 変更のたびに増やす（集計キャッシュの無効化用）
+if "oplog" not in st.session_state:
+    st.session_state.oplog = OpLog()
 if "stats_mydeck_filter" not in st.session_state:
-    st.session_state.stats_mydeck_filter = ""
+    st.session_state.stats_mydeck_filter = None  # deck id
 
 
 
 
-def default_state():
-    return {
-        "deck_types": INITIAL_DECKS,
-        "my_deck": "",
-        "current_opponent": "",
-        "matches": [],  # newest first
-        "stats_mydeck_filter": "",  # 集計対象（空=全体）
-    }
-
-
-def load_data(user_id: str) -> dict:
-    path = user_data_path(user_id)
-    data = read_json(path)  # ← GitHubから読む（無ければNone）
-    if not data:
-        return default_state()
-
-    base = default_state()
-    for k in base.keys():
-        if k in data:
-            base[k] = data[k]
-
-    if not isinstance(base["deck_types"], list):
-        base["deck_types"] = INITIAL_DECKS
-    if not isinstance(base["matches"], list):
-        base["matches"] = []
-    return base
-
-
-
 def save_data():
     uid = st.session_state.user_id
     if not uid:
         return
-    path = user_data_path(uid)
-    data = {
-        "deck_types": st.session_state.deck_types,
-        "my_deck": st.session_state.my_deck,
-        "current_opponent": st.session_state.current_opponent,
-        "matches": st.session_state.matches,
-        "stats_mydeck_filter": st.session_state.stats_mydeck_filter,
-    }
-    write_json(path, data, message=f"Update tracker for {uid}")
+    store.save(st.session_state, user_data_path(uid), uid)
+
+
+def apply_state(data: dict):
+    store.apply_state(st.session_state, data)
+    st.session_state.matches_version += 1
+    # 読み直したら記録済みの位置は使えないので、取り消し履歴は捨てる
+    st.session_state.oplog = OpLog()
+
+
+def ensure_user(user_id: str) -> bool:
+    """
+    user_id の戦績を state に載せる。読み込みは裏で行い、終わるまでは False を返す
+    （その間はベースカタログだけの空の状態で、保存もしない）。
+    """
+    if st.session_state.initialized_for_user == user_id:
+        # 裏の再検証でGitHub側の変更が届いていれば反映
+        remote = store.take_update(user_data_path(user_id))
+        if remote is not None:
+            apply_state(remote)
+            st.toast("GitHub上の最新データを反映しました")
+        return True
+
+    if st.session_state.loading_for_user != user_id:
+        # 前のユーザーの戦績を見せない・読み終わるまで保存しない（空で保存すると上書きになる）
+        st.session_state.user_id = ""
+        st.session_state.initialized_for_user = None
+        st.session_state.loading_for_user = user_id
+        apply_state(store.default_state())
+    try:
+        data = _poll_user(user_id, store.LOAD_WAIT_SEC)
+    except ReadError:
+        # 空の初期状態で続けると、次の保存でGitHub上の戦績を上書きしてしまう
+        st.session_state.loading_for_user = None
+        st.error("GitHubからデータを読み込めませんでした。時間をおいて再読み込みしてください。")
+        st.stop()
+    if data is None:
+        return False
+    st.session_state.user_id = user_id
+    apply_state(data)
+    st.session_state.initialized_for_user = user_id
+    st.session_state.loading_for_user = None
+    return True
+
+
+def _poll_user(user_id: str, wait: float = 0.0):
+    # wait_for_user が先に受け取っていればそれを使う（結果は1回しか取れない）
+    hit = st.session_state.pop("_user_load", None)
+    if hit is not None and hit[0] == user_id:
+        if hit[2] is not None:
+            raise hit[2]
+        return hit[1]
+    return store.poll_state(user_data_path(user_id), wait)
+
+
+@st.fragment(run_every=store.LOAD_POLL_SEC)
+def wait_for_user(user_id: str):
+    # poll_state は読み込みが無くなっていればやり直す（同じユーザーの別セッションが先に受け取った等）。
+    # 読み終わったら結果を預けてアプリ全体を再実行し、本来の状態に差し替える
+    try:
+        data, err = store.poll_state(user_data_path(user_id)), None
+    except ReadError as e:
+        data, err = None, e
+    if data is not None or err is not None:
+        st.session_state["_user_load"] = (user_id, data, err)
+        st.rerun(scope="app")
+    st.caption("⏳ 戦績を読み込み中…")
 
 
 
 # =============================
 # 集計・ユーティリティ
 # =============================
-def get_deck_info(name: str):
-    for d in st.session_state.deck_types:
-        if d["name"] == name:
-            return d
-    return None
+def deck_name(deck_id) -> str:
+    return st.session_state.catalog.name(deck_id)
 
 
-def get_deck_class(name: str) -> str:
-    info = get_deck_info(name)
-    return info["class"] if info and "class" in info else "E"
+def deck_color(deck_id) -> str:
+    cls = st.session_state.catalog.cls(deck_id)
+    return CLASS_COLORS.get(cls, CLASS_COLORS["E"])["color"]
 
 
 def grouped_decks():
     grouped = {k: [] for k in CLASS_ORDER}
-    for d in st.session_state.deck_types:
+    for d in st.session_state.catalog.active():
         grouped.setdefault(d["class"], []).append(d)
     return {k: grouped.get(k, []) for k in CLASS_ORDER}
 
@@ -172,7 +193,7 @@ def compute_stats(matches):
 
 def compute_win_streak(matches):
     streak = 0
-    for m in matches:
+    for m in reversed(matches):
         if m["result"] == "win":
             streak += 1
         else:
@@ -180,88 +201,318 @@ def compute_win_streak(matches):
     return streak
 
 
+# =============================
+# 変更系（すべて操作ログ経由。取り消し / やり直しできる）
+# =============================
+def run_op(label: str, do, undo):
+    st.session_state.oplog.run(label, do, undo)
+    st.session_state.matches_version += 1
+    # 保存はジャーナル経由で裏で送るので、直後の取り消しとまとめて1回の送信になる
+    save_data()
+
+
+def undo_last():
+    label = st.session_state.oplog.undo()
+    if label:
+        st.session_state.matches_version += 1
+        save_data()
+    return label
+
+
+def redo_last():
+    label = st.session_state.oplog.redo()
+    if label:
+        st.session_state.matches_version += 1
+        save_data()
+    return label
+
+
+SELECTION_KEYS = ("my_deck", "current_opponent", "stats_mydeck_filter")
+
+
+def _remap_selection(old, new, keys=SELECTION_KEYS):
+    """
+    選択中の old を new に付け替え、付け替えた項目を返す。
+    操作の取り消しでは、その操作が付け替えた項目だけを（後から選び直されていなければ）戻す。
+    """
+    changed = [k for k in keys if st.session_state[k] == old]
+    for k in changed:
+        st.session_state[k] = new
+    return changed
+
+
+def _unmap_selection(changed, old, new):
+    for k in changed:
+        if st.session_state[k] == new:
+            st.session_state[k] = old
+
+
 def add_match(result: str):
     if not st.session_state.my_deck or not st.session_state.current_opponent:
         return
-    my = st.session_state.my_deck
     opp = st.session_state.current_opponent
-    new_match = {
-        "id": int(datetime.now().timestamp() * 1000),
-        "my_deck": my,
-        "my_deck_class": get_deck_class(my),
-        "opponent_deck": opp,
-        "opponent_deck_class": get_deck_class(opp),
-        "result": result,  # win/loss
-        "timestamp": datetime.now().isoformat(timespec="seconds"),
-    }
-    st.session_state.matches = [new_match] + st.session_state.matches
-    st.session_state.current_opponent = ""
-    save_data()
+    new_match = store.new_match(st.session_state.my_deck, opp, result)
+    matches = st.session_state.matches
 
+    def do():
+        store.add_match(st.session_state, new_match)
 
-def update_match(match_id: int, new_my: str, new_opp: str, new_result: str):
-    updated = []
-    for m in st.session_state.matches:
-        if m["id"] == match_id:
-            m = dict(m)
-            m["my_deck"] = new_my
-            m["my_deck_class"] = get_deck_class(new_my)
-            m["opponent_deck"] = new_opp
-            m["opponent_deck_class"] = get_deck_class(new_opp)
-            m["result"] = new_result
-        updated.append(m)
-    st.session_state.matches = updated
-    save_data()
+    def undo():
+        # 取り消し後はすぐ正しい結果を押し直せるように対戦相手を戻す
+        matches.pop()
+        st.session_state.current_opponent = opp
+
+    run_op(f"{'勝利' if result == 'win' else '敗北'} vs {deck_name(opp)}", do, undo)
+
+
+def _match_index(match_id: int):
+    matches = st.session_state.matches
+    for i in range(len(matches) - 1, -1, -1):
+        if matches[i]["id"] == match_id:
+            return i
+    return None
+
+
+def update_match(match_id: int, new_my: int, new_opp: int, new_result: str):
+    i = _match_index(match_id)
+    if i is None:
+        return
+    matches = st.session_state.matches
+    old = matches[i]
+    new = dict(old, my_deck_id=new_my, opponent_deck_id=new_opp, result=new_result)
+
+    def do():
+        matches[i] = new
+
+    def undo():
+        matches[i] = old
+
+    run_op("戦績の修正", do, undo)
 
 
 def delete_match(match_id: int):
-    st.session_state.matches = [m for m in st.session_state.matches if m["id"] != match_id]
-    save_data()
+    i = _match_index(match_id)
+    if i is None:
+        return
+    matches = st.session_state.matches
+    old = matches[i]
+
+    def do():
+        del matches[i]
+
+    def undo():
+        matches.insert(i, old)
+
+    run_op("戦績の削除", do, undo)
 
 
 def add_deck(name: str, cls: str):
     name = name.strip()
     if not name:
         return "デッキ名が空です"
-    if any(d["name"] == name for d in st.session_state.deck_types):
-        return "同名デッキが既に存在します"
     if cls not in CLASS_COLORS:
         return "クラスが不正です"
-    st.session_state.deck_types.append({"name": name, "class": cls})
-    save_data()
+    catalog = st.session_state.catalog
+    if catalog.id_of(name) is not None:
+        return "同名デッキが既に存在します"
+    deck_id = catalog.next_id
+    catalog.next_id += 1  # id は取り消し後も再利用しない
+    cleared = []
+
+    def do():
+        catalog.add(name, cls, deck_id)
+        _unmap_selection(cleared, deck_id, None)
+
+    def undo():
+        catalog.remove_last(deck_id)
+        cleared[:] = _remap_selection(deck_id, None)
+
+    run_op(f"デッキ追加: {name}", do, undo)
     return None
 
 
-def delete_deck(name: str):
-    st.session_state.deck_types = [d for d in st.session_state.deck_types if d["name"] != name]
-    if st.session_state.my_deck == name:
-        st.session_state.my_deck = ""
-    if st.session_state.current_opponent == name:
-        st.session_state.current_opponent = ""
-    save_data()
+def rename_deck(deck_id: int, new_name: str):
+    new_name = new_name.strip()
+    if not new_name:
+        return "デッキ名が空です"
+    catalog = st.session_state.catalog
+    if not catalog.is_active(deck_id):
+        return "デッキが見つかりません"
+    other = catalog.id_of(new_name)
+    if other is not None and other != deck_id:
+        return "同名デッキが既に存在します"
+    old_name = catalog.name(deck_id)
 
+    run_op(
+        f"デッキ名変更: {old_name} → {new_name}",
+        lambda: catalog.rename(deck_id, new_name),
+        lambda: catalog.rename(deck_id, old_name),
+    )
+    return None
+
+
+def merge_deck(src_id: int, dst_id: int):
+    # src の戦績は dst として集計される（戦績自体は書き換えない）
+    catalog = st.session_state.catalog
+    src, dst = catalog.resolve(src_id), catalog.resolve(dst_id)
+    if src == dst:
+        return "同じデッキは統合できません"
+    changed = []
+
+    def do():
+        catalog.merge(src, dst)
+        changed[:] = _remap_selection(src, dst)
+
+    def undo():
+        catalog.unmerge(src)
+        _unmap_selection(changed, src, dst)
+
+    run_op(f"デッキ統合: {deck_name(src)} → {deck_name(dst)}", do, undo)
+    return None
 
-def build_mydeck_table(matches_all):
-    rows = []
-    mydecks = sorted(list({m["my_deck"] for m in matches_all}))
-    for md in mydecks:
-        ms = [m for m in matches_all if m["my_deck"] == md]
-        t, w, l, wr = compute_stats(ms)
-        rows.append({"Deck": md, "Matches": t, "Wins": w, "Losses": l, "WinRate(%)": wr})
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return df
-    df = df.sort_values(["Matches", "WinRate(%)"], ascending=[False, False]).reset_index(drop=True)
-    return df
+
+def delete_deck(deck_id: int):
+    # 削除はアーカイブ（選択肢から消えるが、戦績上の名前は残る）
+    catalog = st.session_state.catalog
+    cleared = []
+
+    def do():
+        catalog.archive(deck_id)
+        # 集計対象は削除済みデッキでも選べるので残す
+        cleared[:] = _remap_selection(deck_id, None, ("my_deck", "current_opponent"))
+
+    def undo():
+        catalog.unarchive(deck_id)
+        _unmap_selection(cleared, deck_id, None)
+
+    run_op(f"デッキ削除: {deck_name(deck_id)}", do, undo)
+
+
+def deck_counters(matches, field: str):
+    # matches が変わったとき（matches_version が進んだとき）だけ数え直す
+    cache = st.session_state.setdefault("_deck_counters", {})
+    version = st.session_state.matches_version
+    hit = cache.get(field)
+    if hit is None or hit[0] != version:
+        hit = cache[field] = (version, count_by(matches, lambda m: m[field]))
+    # 統合は描画時に解決する（戦績は統合前の id のまま）
+    return remap(hit[1], st.session_state.catalog.resolve)
+
+
+def render_deck_buttons(ids, selected, key_prefix: str, per_row: int = 3, disabled: bool = False):
+    # 折れにくいよう per_row 列で並べる。押された deck id を返す
+    picked = None
+    for i in range(0, len(ids), per_row):
+        row = st.columns(per_row, gap="small")
+        chunk = ids[i:i+per_row]
+        for j in range(per_row):
+            if j >= len(chunk):
+                row[j].empty()
+                continue
+            deck_id = chunk[j]
+            name = deck_name(deck_id)
+            label = f"✅ {name}" if selected == deck_id else name
+            with row[j]:
+                if st.button(label, key=f"{key_prefix}_{deck_id}", disabled=disabled):
+                    picked = deck_id
+    return picked
+
+
+def deck_picker(kind: str, field: str, selected, disabled: bool = False):
+    """
+    検索 → 最近・よく使う → 選んだクラスだけ、の順に出す（全デッキ分のボタンは作らない）。
+    押された deck id を返す。disabled なら押せない（ユーザーデータの読み込み中）。
+    """
+    catalog = st.session_state.catalog
+    query = st.text_input("デッキ検索", key=f"{kind}_q", placeholder="🔍 デッキ名・クラス名で検索",
+                          label_visibility="collapsed")
+    if query.strip():
+        class_names = {k: v["name"] for k, v in CLASS_COLORS.items()}
+        hits, n = picker.search(catalog.active(), query, class_names)
+        if not hits:
+            st.caption("該当するデッキがありません。")
+        picked = render_deck_buttons([d["id"] for d in hits], selected, f"{kind}_hit", disabled=disabled)
+        if n > len(hits):
+            st.caption(f"ほか {n - len(hits)} 件（語を足して絞り込んでください）")
+        return picked
+
+    picked = None
+    matches = st.session_state.matches
+    ids = picker.shortcuts(matches, field, deck_counters(matches, field), catalog.resolve, catalog.is_active)
+    if ids:
+        st.markdown("<div class='small-muted' style='margin-top:6px;'>最近・よく使う</div>", unsafe_allow_html=True)
+        picked = render_deck_buttons(ids, selected, f"{kind}_fav", disabled=disabled)
+
+    ck = st.radio(
+        "クラス",
+        [None] + CLASS_ORDER,
+        format_func=lambda k: "クラスから選ぶ ▸" if k is None else CLASS_COLORS[k]["name"],
+        horizontal=True,
+        key=f"{kind}_cls",
+        label_visibility="collapsed",
+    )
+    if ck is not None:
+        ids = [d["id"] for d in grouped_decks().get(ck, [])]
+        if not ids:
+            st.caption("このクラスのデッキはありません。")
+        picked = render_deck_buttons(ids, selected, f"{kind}_cls", disabled=disabled) or picked
+    return picked
+
+
+def render_rank_cards(rows, worst=False):
+    # カード描画（NO.1〜3 + デッキ名 + 勝率）
+    # 苦手側の score は負け側のものなので出さない（勝率と逆向きの数字が並ぶため）。代わりに勝敗数
+    for i, (deck, w, n, score) in enumerate(rows, start=1):
+        wr = (w / n) * 100 if n else 0.0
+        sub = f"n={n} / {w}勝{n - w}敗" if worst else f"n={n} / score={score * 100:.1f}"
+        st.markdown(
+            f"""
+            <div class="rank-card rank-{i}">
+              <div class="rank-left">
+                <div class="rank-no">NO.{i}</div>
+                <div>
+                  <div class="rank-deck">{deck_name(deck)}</div>
+                  <div class="rank-sub">{sub}</div>
+                </div>
+              </div>
+              <div class="rank-rate">{wr:.1f}%</div>
+            </div>
+            """,
+            unsafe_allow_html=True,
+        )
+
+
+def lazy_pandas():
+    # pandas は集計ビューでしか使わないので初回表示時に読み込む
+    first = "pandas" not in sys.modules
+    t = time.perf_counter()
+    import pandas as pd
+    if first:
+        st.session_state["_pandas_import_ms"] = (time.perf_counter() - t) * 1000
+    return pd
+
+
+def report_timings(view: str):
+    if not SHOW_TIMINGS:
+        return
+    ms = (time.perf_counter() - _T0) * 1000
+    pd_ms = st.session_state.get("_pandas_import_ms")
+    msg = f"[timing] view={view} rerun={ms:.1f}ms skipped_writes={github_kv.skipped_writes()}"
+    if pd_ms is not None:
+        msg += f" pandas_import={pd_ms:.1f}ms"
+    _timing_log.info(msg)
+    st.caption(msg)
 
 
 def build_opponent_table(matches_filtered):
-    opps = sorted(list({m["opponent_deck"] for m in matches_filtered}))
+    pd = lazy_pandas()
+    counters = remap(count_by(matches_filtered, lambda m: m["opponent_deck_id"]),
+                     st.session_state.catalog.resolve)
     rows = []
-    for opp in opps:
-        ms = [m for m in matches_filtered if m["opponent_deck"] == opp]
-        t, w, l, wr = compute_stats(ms)
-        rows.append({"Opponent": opp, "Matches": t, "Wins": w, "Losses": l, "WinRate(%)": wr})
+    for opp in sorted(counters, key=deck_name):
+        w, t = counters[opp]
+        wr = round((w / t) * 100, 1) if t else 0.0
+        rows.append({"Opponent": deck_name(opp), "Matches": t, "Wins": w, "Losses": t - w, "WinRate(%)": wr})
     df = pd.DataFrame(rows)
     if df.empty:
         return df
@@ -504,22 +755,27 @@ uid = sanitize_user_id(uid_raw)
 # ---- init by user
 if "initialized_for_user" not in st.session_state:
     st.session_state.initialized_for_user = None
+if "loading_for_user" not in st.session_state:
+    st.session_state.loading_for_user = None  # 裏で読み込み中のユーザー
 
 
 st.title("Shadowverse WB Tracker")
 st.caption("戦績管理（ユーザー別）")
 
 
-tab_input, tab_stats = st.tabs(["入力", "集計"])
+# st.tabs は両方のタブ本体を毎回実行してしまうので、表示中のビューだけ実行する
+VIEW_INPUT = "入力"
+VIEW_STATS = "集計"
+view = st.radio("表示", [VIEW_INPUT, VIEW_STATS], horizontal=True, key="view", label_visibility="collapsed")
 
 # =============================
 # 入力タブ
 # =============================
-with tab_input:
+if view == VIEW_INPUT:
     # ---- ユーザー（サイドバーから移動）
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.markdown("<div class='section-title'>ユーザー</div>", unsafe_allow_html=True)
-    uid_raw = st.text_input("ユーザー名", value=st.session_state.get("user_id_raw", ""), key="user_id_raw")
+    uid_raw = st.text_input("ユーザー名", key="user_id_raw")
     uid = sanitize_user_id(uid_raw)
     if not uid:
         st.warning("ユーザー名を入力してください。")
@@ -530,15 +786,12 @@ with tab_input:
         st.markdown("</div>", unsafe_allow_html=True)
 
     # ---- init by user (after uid decided)
-    if st.session_state.initialized_for_user != uid:
-        data = load_data(uid)
-        st.session_state.user_id = uid
-        st.session_state.deck_types = data["deck_types"]
-        st.session_state.my_deck = data["my_deck"]
-        st.session_state.current_opponent = data["current_opponent"]
-        st.session_state.matches = data["matches"]
-        st.session_state.stats_mydeck_filter = data.get("stats_mydeck_filter", "")
-        st.session_state.initialized_for_user = uid
+    # 読み込みを待たずに描画する（読み終わるまでピッカーは押せない）
+    loading = not ensure_user(uid)
+    if loading:
+        wait_for_user(uid)
+    elif local_cache.is_pending(user_data_path(uid)):
+        st.caption("⏳ GitHubへ未同期の変更があります（自動で再送します）")
 
     left, right = st.columns([1.05, 1.35], gap="large")
 
@@ -547,77 +800,89 @@ with tab_input:
         st.markdown("<div class='card'>", unsafe_allow_html=True)
         st.markdown("<div class='section-title'>マイデッキ</div>", unsafe_allow_html=True)
 
-        grouped = grouped_decks()
-        PER_ROW = 3  # 折れにくい
+        picked = deck_picker("my", "my_deck_id", st.session_state.my_deck, disabled=loading)
+        if picked is not None:
+            st.session_state.my_deck = picked
+            st.session_state.current_opponent = None
+            save_data()
+            st.rerun()
 
-        for ck in CLASS_ORDER:
-            decks = grouped.get(ck, [])
-            if not decks:
-                continue
-            info = CLASS_COLORS[ck]
-            st.markdown(
-                f"<div style='margin-top:10px; margin-bottom:6px; color:{info['color']}; font-weight:900;'>● {info['name']}</div>",
-                unsafe_allow_html=True,
-            )
-            for i in range(0, len(decks), PER_ROW):
-                row = st.columns(PER_ROW, gap="small")
-                chunk = decks[i:i+PER_ROW]
-                for j in range(PER_ROW):
-                    if j >= len(chunk):
-                        row[j].empty()
-                        continue
-                    name = chunk[j]["name"]
-                    selected = (st.session_state.my_deck == name)
-                    label = f"✅ {name}" if selected else name
-                    with row[j]:
-                        if st.button(label, key=f"my_{ck}_{name}"):
-                            st.session_state.my_deck = name
-                            st.session_state.current_opponent = ""
-                            save_data()
-                            st.rerun()
-
-        if st.session_state.my_deck:
-            ci = CLASS_COLORS.get(get_deck_class(st.session_state.my_deck), CLASS_COLORS["E"])
+        if loading:
+            st.info("⏳ 選択中のデッキを読み込み中…")
+        elif st.session_state.my_deck:
             st.markdown(
                 f"<div class='small-muted' style='margin-top:10px;'>選択中</div>"
-                f"<div style='font-weight:900; color:{ci['color']};'>{st.session_state.my_deck}</div>",
+                f"<div style='font-weight:900; color:{deck_color(st.session_state.my_deck)};'>{deck_name(st.session_state.my_deck)}</div>",
                 unsafe_allow_html=True,
             )
         else:
             st.info("まずはマイデッキを選択してください。")
 
-        st.divider()
+        if not loading:
+            st.divider()
 
-        st.markdown("<div class='section-title'>デッキ管理</div>", unsafe_allow_html=True)
+            st.markdown("<div class='section-title'>デッキ管理</div>", unsafe_allow_html=True)
 
-        # --- デッキ追加（常時表示）
-        st.markdown("**デッキ追加**")
-        new_name = st.text_input("デッキ名", value="", placeholder="例: 新型〇〇", key="new_deck_name")
-        new_cls = st.selectbox(
-            "クラス",
-            CLASS_ORDER,
-            format_func=lambda k: CLASS_COLORS[k]["name"],
-            key="new_deck_class",
-        )
-        if st.button("追加", key="add_deck_btn"):
-            err = add_deck(new_name, new_cls)
-            if err:
-                st.error(err)
-            else:
-                st.success("追加しました")
-                st.rerun()
+            # --- デッキ追加（常時表示）
+            st.markdown("**デッキ追加**")
+            new_name = st.text_input("デッキ名", value="", placeholder="例: 新型〇〇", key="new_deck_name")
+            new_cls = st.selectbox(
+                "クラス",
+                CLASS_ORDER,
+                format_func=lambda k: CLASS_COLORS[k]["name"],
+                key="new_deck_class",
+            )
+            if st.button("追加", key="add_deck_btn"):
+                err = add_deck(new_name, new_cls)
+                if err:
+                    st.error(err)
+                else:
+                    st.success("追加しました")
+                    st.rerun()
+
+            st.markdown("---")
+
+            all_ids = [d["id"] for d in st.session_state.catalog.active()]
+
+            # --- デッキ名変更（戦績は書き換えない）
+            st.markdown("**デッキ名変更**")
+            if all_ids:
+                ren_target = st.selectbox("変更するデッキ", all_ids, format_func=deck_name, key="ren_target")
+                ren_name = st.text_input("新しいデッキ名", value="", key="ren_name")
+                if st.button("変更する", key="ren_deck_btn"):
+                    err = rename_deck(ren_target, ren_name)
+                    if err:
+                        st.error(err)
+                    else:
+                        st.success("変更しました")
+                        st.rerun()
+
+            st.markdown("---")
+
+            # --- デッキ統合（同じデッキだった2つをまとめる）
+            st.markdown("**デッキ統合（戦績は統合先に合算）**")
+            if len(all_ids) >= 2:
+                merge_src = st.selectbox("統合元", all_ids, format_func=deck_name, key="merge_src")
+                merge_dst = st.selectbox("統合先", [i for i in all_ids if i != merge_src], format_func=deck_name, key="merge_dst")
+                if st.button("統合する", key="merge_deck_btn"):
+                    err = merge_deck(merge_src, merge_dst)
+                    if err:
+                        st.error(err)
+                    else:
+                        st.success("統合しました")
+                        st.rerun()
 
-        st.markdown("---")
+            st.markdown("---")
 
-        # --- デッキ削除（常時表示 / 戦績は残る）
-        st.markdown("**デッキ削除（戦績は残る）**")
-        all_names = [d["name"] for d in st.session_state.deck_types]
-        if all_names:
-            del_target = st.selectbox("削除するデッキ", all_names, key="del_target")
-            if st.button("削除する", key="del_deck_btn"):
-                delete_deck(del_target)
-                st.success(f"削除: {del_target}")
-                st.rerun()
+            # --- デッキ削除（常時表示 / 戦績は残る）
+            st.markdown("**デッキ削除（戦績は残る）**")
+            if all_ids:
+                del_target = st.selectbox("削除するデッキ", all_ids, format_func=deck_name, key="del_target")
+                if st.button("削除する", key="del_deck_btn"):
+                    del_name = deck_name(del_target)
+                    delete_deck(del_target)
+                    st.success(f"削除: {del_name}")
+                    st.rerun()
 
         st.markdown("</div>", unsafe_allow_html=True)
 
@@ -626,41 +891,35 @@ with tab_input:
         st.markdown("<div class='card'>", unsafe_allow_html=True)
         st.markdown("<div class='section-title'>対戦入力</div>", unsafe_allow_html=True)
 
-        if not st.session_state.my_deck:
+        # ---- 取り消し / やり直し（記録直後の押し間違い用）
+        last_undo = st.session_state.oplog.last_undo()
+        last_redo = st.session_state.oplog.last_redo()
+        if last_undo or last_redo:
+            u1, u2 = st.columns(2, gap="small")
+            with u1:
+                if last_undo and st.button(f"↩ 取り消す（{last_undo}）", use_container_width=True, key="undo_btn"):
+                    undo_last()
+                    st.rerun()
+            with u2:
+                if last_redo and st.button(f"↪ やり直す（{last_redo}）", use_container_width=True, key="redo_btn"):
+                    redo_last()
+                    st.rerun()
+
+        if loading:
+            deck_picker("opp", "opponent_deck_id", None, disabled=True)
+            st.info("⏳ 戦績を読み込み中…")
+        elif not st.session_state.my_deck:
             st.warning("左でマイデッキを選択してください。")
         else:
-            grouped = grouped_decks()
-            PER_ROW_OPP = 3
-
-            for ck in CLASS_ORDER:
-                decks = grouped.get(ck, [])
-                if not decks:
-                    continue
-                info = CLASS_COLORS[ck]
-                st.markdown(
-                    f"<div style='margin-top:10px; margin-bottom:6px; color:{info['color']}; font-weight:900;'>● {info['name']}</div>",
-                    unsafe_allow_html=True,
-                )
-                for i in range(0, len(decks), PER_ROW_OPP):
-                    row = st.columns(PER_ROW_OPP, gap="small")
-                    chunk = decks[i:i+PER_ROW_OPP]
-                    for j in range(PER_ROW_OPP):
-                        if j >= len(chunk):
-                            row[j].empty()
-                            continue
-                        name = chunk[j]["name"]
-                        selected = (st.session_state.current_opponent == name)
-                        label = f"✅ {name}" if selected else name
-                        with row[j]:
-                            if st.button(label, key=f"opp_{ck}_{name}"):
-                                st.session_state.current_opponent = name
-                                save_data()
+            picked = deck_picker("opp", "opponent_deck_id", st.session_state.current_opponent)
+            if picked is not None:
+                st.session_state.current_opponent = picked
+                save_data()
 
             if st.session_state.current_opponent:
-                opp_ci = CLASS_COLORS.get(get_deck_class(st.session_state.current_opponent), CLASS_COLORS["E"])
                 st.markdown(
                     f"<div class='small-muted' style='margin-top:10px;'>対戦相手</div>"
-                    f"<div style='font-weight:900; color:{opp_ci['color']};'>{st.session_state.current_opponent}</div>",
+                    f"<div style='font-weight:900; color:{deck_color(st.session_state.current_opponent)};'>{deck_name(st.session_state.current_opponent)}</div>",
                     unsafe_allow_html=True,
                 )
 
@@ -684,7 +943,14 @@ with tab_input:
 # =============================
 # 集計タブ（表＋メトリクス）
 # =============================
-with tab_stats:
+else:
+    if uid and st.session_state.loading_for_user == uid and not ensure_user(uid):
+        wait_for_user(uid)
+        st.stop()
+    if not uid or st.session_state.initialized_for_user != uid:
+        st.info("入力タブでユーザー名を入力してください。")
+        st.stop()
+
     matches_all = st.session_state.matches
     if not matches_all:
         st.info("まだ戦績がありません。入力タブで記録してください。")
@@ -694,14 +960,13 @@ with tab_stats:
     # st.markdown("<div class='section-title'>集計対象</div>", unsafe_allow_html=True)
 
     # ---- 集計対象（入力タブと同じ：クラスごと）
-    # ※ 戦績に一度でも登場したマイデッキのみを表示
-    mydecks_in_stats = sorted(list({m["my_deck"] for m in matches_all}))
-    mydecks_in_stats_set = set(mydecks_in_stats)
+    # ※ 戦績に一度でも登場したマイデッキのみを表示（統合済みは統合先、削除済みも表示）
+    catalog = st.session_state.catalog
+    mydecks_in_stats = deck_counters(matches_all, "my_deck_id")
 
     decks_by_class = {k: [] for k in CLASS_ORDER}
-    for d in st.session_state.deck_types:
-        if d["name"] in mydecks_in_stats_set:
-            decks_by_class.get(d["class"], []).append(d["name"])
+    for deck_id in sorted(mydecks_in_stats, key=deck_name):
+        decks_by_class.setdefault(catalog.cls(deck_id), []).append(deck_id)
 
     # ---- 全体
     # all_selected = (st.session_state.stats_mydeck_filter == "")
@@ -713,36 +978,37 @@ with tab_stats:
 
     PER_ROW_STATS = 3
     for ck in CLASS_ORDER:
-        names = decks_by_class.get(ck, [])
-        if not names:
+        ids = decks_by_class.get(ck, [])
+        if not ids:
             continue
         info = CLASS_COLORS[ck]
         st.markdown(
             f"<div style='margin-top:10px; margin-bottom:6px; color:{info['color']}; font-weight:900;'>● {info['name']}</div>",
             unsafe_allow_html=True,
         )
-        for i in range(0, len(names), PER_ROW_STATS):
+        for i in range(0, len(ids), PER_ROW_STATS):
             cols = st.columns(PER_ROW_STATS, gap="small")
-            chunk = names[i:i+PER_ROW_STATS]
+            chunk = ids[i:i+PER_ROW_STATS]
             for j in range(PER_ROW_STATS):
                 if j >= len(chunk):
                     cols[j].empty()
                     continue
-                name = chunk[j]
-                selected = (st.session_state.stats_mydeck_filter == name)
+                deck_id = chunk[j]
+                name = deck_name(deck_id)
+                selected = (st.session_state.stats_mydeck_filter == deck_id)
                 label = f"✅ {name}" if selected else name
                 with cols[j]:
-                    if st.button(label, key=f"stats_{ck}_{name}", use_container_width=True,
+                    if st.button(label, key=f"stats_{deck_id}", use_container_width=True,
                                  type="primary" if selected else "secondary"):
-                        st.session_state.stats_mydeck_filter = name
+                        st.session_state.stats_mydeck_filter = deck_id
                         save_data()
                         st.rerun()
 # ---- スコープ
     if st.session_state.stats_mydeck_filter:
-        scope_label = st.session_state.stats_mydeck_filter
-        matches_scope = [m for m in matches_all if m["my_deck"] == scope_label]
-        scope_cls = get_deck_class(scope_label)
-        scope_color = CLASS_COLORS.get(scope_cls, CLASS_COLORS["E"])["color"]
+        scope_id = catalog.resolve(st.session_state.stats_mydeck_filter)
+        scope_label = deck_name(scope_id)
+        matches_scope = [m for m in matches_all if catalog.resolve(m["my_deck_id"]) == scope_id]
+        scope_color = deck_color(scope_id)
     else:
         scope_label = "全体"
         matches_scope = matches_all
@@ -819,42 +1085,32 @@ with tab_stats:
         st.markdown("<div class='card'>", unsafe_allow_html=True)
         st.markdown("<div class='section-title'>得意デッキ Top3（勝率）</div>", unsafe_allow_html=True)
 
-        df_md = build_mydeck_table(matches_all)
-        if df_md.empty:
+        # Wilson下限で並べる（少数試合の100%が上に来ない）。3戦以上を優先
+        rows = rank(mydecks_in_stats, k=3)
+        if not rows:
             st.caption("データがありません。")
         else:
-            # 少数試合でのブレを避けたいので、まずは「3戦以上」を優先してランキング
-            df_rank_base = df_md.copy()
-            df_rank_3 = df_rank_base[df_rank_base["Matches"] >= 3]
-            df_rank = df_rank_3 if not df_rank_3.empty else df_rank_base
-            df_rank = df_rank.sort_values(["WinRate(%)", "Matches"], ascending=[False, False]).reset_index(drop=True).head(3)
-
-            # カード描画（NO.1〜3 + デッキ名 + 勝率）
-            for i, (_, r) in enumerate(df_rank.iterrows(), start=1):
-                # build_mydeck_table() は列名が "Deck" / "WinRate(%)" / "Matches"
-                deck = r.get("Deck", "")
-                wr = r.get("WinRate(%)", 0.0)
-                n = int(r.get("Matches", 0))
-                st.markdown(
-                    f"""
-                    <div class="rank-card rank-{i}">
-                      <div class="rank-left">
-                        <div class="rank-no">NO.{i}</div>
-                        <div>
-                          <div class="rank-deck">{deck}</div>
-                          <div class="rank-sub">n={n}</div>
-                        </div>
-                      </div>
-                      <div class="rank-rate">{wr:.1f}%</div>
-                    </div>
-                    """,
-                    unsafe_allow_html=True,
-                )
-            
-
-        st.markdown("</div>", unsafe_allow_html=True)
+            render_rank_cards(rows)
 
+        if st.session_state.stats_mydeck_filter:
+            opp_counters = remap(count_by(matches_scope, lambda m: m["opponent_deck_id"]), catalog.resolve)
+        else:
+            opp_counters = deck_counters(matches_all, "opponent_deck_id")
 
+        st.markdown("<div class='section-title' style='margin-top:12px;'>得意対面 Top3</div>", unsafe_allow_html=True)
+        rows = rank(opp_counters, k=3)
+        if not rows:
+            st.caption("データがありません。")
+        else:
+            render_rank_cards(rows)
 
+        st.markdown("<div class='section-title' style='margin-top:12px;'>苦手対面 Top3</div>", unsafe_allow_html=True)
+        rows = rank(opp_counters, k=3, worst=True)
+        if not rows:
+            st.caption("負け越している対面はありません。" if opp_counters else "データがありません。")
+        else:
+            render_rank_cards(rows, worst=True)
 
+        st.markdown("</div>", unsafe_allow_html=True)
 
+report_timings(view)
@@ -0,0 +1,349 @@
+# decks.py
+# デッキカタログ（安定ID）とユーザーデータの移行
+#
+# ベースカタログ（INITIAL_DECKS）はプロセス共通の読み取り専用。
+# ユーザーごとには差分（追加したデッキ / ベースへの変更）だけを持ち、保存もその差分だけにする。
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+SCHEMA_VERSION = 3
+
+# ベースカタログを変えたら上げる（差分側に記録しておき、将来の移行に使う）
+BASE_CATALOG_VERSION = 1
+
+# ユーザーが追加したデッキの id はここから（ベースのデッキは 1〜999 を使う）
+USER_DECK_ID_START = 1000
+
+# id は固定（戦績は id でデッキを参照する。既存の id は変えないこと）
+_INITIAL_DECKS = [
+    {"id": 1, "name": "リノE", "class": "E"},
+    {"id": 2, "name": "テンポE", "class": "E"},
+    {"id": 3, "name": "進化E", "class": "E"},
+    {"id": 4, "name": "不殺E", "class": "E"},
+    {"id": 5, "name": "財宝R", "class": "R"},
+    {"id": 6, "name": "進化R", "class": "R"},
+    {"id": 7, "name": "オルオーンR", "class": "R"},
+    {"id": 8, "name": "ほーちゃんD", "class": "D"},
+    {"id": 9, "name": "進化D", "class": "D"},
+    {"id": 10, "name": "ランプD", "class": "D"},
+    {"id": 11, "name": "海洋D", "class": "D"},
+    {"id": 12, "name": "スペル秘術W", "class": "W"},
+    {"id": 13, "name": "秘術W", "class": "W"},
+    {"id": 14, "name": "スペルW", "class": "W"},
+    {"id": 15, "name": "リンクルW", "class": "W"},
+    {"id": 16, "name": "リアニメイトNi", "class": "Ni"},
+    {"id": 17, "name": "モードNi", "class": "Ni"},
+    {"id": 18, "name": "ミルティオNi", "class": "Ni"},
+    {"id": 19, "name": "進化Ni", "class": "Ni"},
+    {"id": 20, "name": "ミッドレンジNi", "class": "Ni"},
+    {"id": 21, "name": "シャクドウNi", "class": "Ni"},
+    {"id": 22, "name": "アグロNi", "class": "Ni"},
+    {"id": 23, "name": "奇数B", "class": "B"},
+    {"id": 24, "name": "クレストB", "class": "B"},
+    {"id": 25, "name": "守護B", "class": "B"},
+    {"id": 26, "name": "破壊Nm", "class": "Nm"},
+    {"id": 27, "name": "人形Nm", "class": "Nm"},
+    {"id": 28, "name": "アーティファクトNm", "class": "Nm"},
+]
+
+INITIAL_DECKS = tuple(MappingProxyType(d) for d in _INITIAL_DECKS)
+_BASE_BY_ID: Mapping[int, Mapping[str, Any]] = MappingProxyType({d["id"]: d for d in INITIAL_DECKS})
+
+
+def _diff(base: Mapping[str, Any], d: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in d.items() if base.get(k) != v}
+
+
+class DeckCatalog:
+    """
+    デッキ一覧を id で引けるようにしたもの。
+    戦績は id だけを持ち、名前・クラスは描画時にここから引く。
+    改名・統合・アーカイブはカタログ内の1件を書き換えるだけ（戦績は触らない）。
+
+    ベースのデッキは共有したまま参照し、書き換えるときだけそのデッキを自分用にコピーする。
+    """
+
+    def __init__(self, overlay: Optional[Dict[str, Any]] = None):
+        overlay = overlay or {}
+        self._own: Dict[int, Dict[str, Any]] = {}  # ユーザー追加 + 書き換えたベースのコピー
+        self._added: List[int] = []
+        for d in overlay.get("added") or []:
+            self._own[d["id"]] = dict(d)
+            self._added.append(d["id"])
+        for key, patch in (overlay.get("patch") or {}).items():
+            base = _BASE_BY_ID.get(int(key))
+            if base is not None:
+                self._own[base["id"]] = {**base, **patch}
+        self.next_id = max(overlay.get("next_id") or 0, USER_DECK_ID_START,
+                           max(self._added, default=0) + 1)
+        self._by_name: Dict[str, int] = {d["name"]: d["id"] for d in self._all() if self._visible(d)}
+
+    @staticmethod
+    def _visible(d: Mapping[str, Any]) -> bool:
+        return not d.get("archived") and d.get("merged_into") is None
+
+    def _all(self) -> Iterator[Mapping[str, Any]]:
+        for base in INITIAL_DECKS:
+            yield self._own.get(base["id"], base)
+        for deck_id in self._added:
+            yield self._own[deck_id]
+
+    def _lookup(self, deck_id: Optional[int]) -> Optional[Mapping[str, Any]]:
+        d = self._own.get(deck_id)
+        return d if d is not None else _BASE_BY_ID.get(deck_id)
+
+    def _writable(self, deck_id: int) -> Optional[Dict[str, Any]]:
+        d = self._own.get(deck_id)
+        if d is None:
+            base = _BASE_BY_ID.get(deck_id)
+            if base is None:
+                return None
+            d = self._own[deck_id] = dict(base)
+        return d
+
+    # ---- 参照
+    def get(self, deck_id: Optional[int]) -> Optional[Mapping[str, Any]]:
+        if self._lookup(deck_id) is None:
+            return None
+        return self._lookup(self.resolve(deck_id))
+
+    def resolve(self, deck_id: Optional[int]) -> Optional[int]:
+        """
+        統合先をたどって最終的な id を返す。
+        リンクは書き換えない（統合の取り消しで元の統合先に戻れるように。統合の連鎖は短い）。
+        """
+        d = self._lookup(deck_id)
+        if d is None:
+            return deck_id
+        root = deck_id
+        while d is not None and d.get("merged_into") is not None:
+            root = d["merged_into"]
+            d = self._lookup(root)
+        return root
+
+    def name(self, deck_id: Optional[int]) -> str:
+        d = self.get(deck_id)
+        return d["name"] if d else "（不明なデッキ）"
+
+    def cls(self, deck_id: Optional[int]) -> Optional[str]:
+        d = self.get(deck_id)
+        return d["class"] if d else None
+
+    def id_of(self, name: str) -> Optional[int]:
+        return self._by_name.get(name)
+
+    def active(self) -> List[Mapping[str, Any]]:
+        """ピッカーに出すデッキ（アーカイブ・統合済みを除く）"""
+        return [d for d in self._all() if self._visible(d)]
+
+    def is_active(self, deck_id: Optional[int]) -> bool:
+        d = self._lookup(deck_id)
+        return d is not None and self._visible(d)
+
+    # ---- 更新（戻り値はエラーメッセージ。成功なら None）
+    def add(self, name: str, cls: str, deck_id: Optional[int] = None) -> Optional[str]:
+        """deck_id はやり直し用（取り消した add と同じ id で戻す）。省略時は新しい id。"""
+        if name in self._by_name:
+            return "同名デッキが既に存在します"
+        if deck_id is None:
+            deck_id = self.next_id
+            self.next_id += 1
+        elif deck_id in self._own or deck_id in _BASE_BY_ID:
+            return "デッキIDが重複しています"
+        d = {"id": deck_id, "name": name, "class": cls}
+        self._own[d["id"]] = d
+        self._added.append(d["id"])
+        self._by_name[name] = d["id"]
+        return None
+
+    def rename(self, deck_id: int, new_name: str) -> Optional[str]:
+        if not self.is_active(deck_id):
+            return "デッキが見つかりません"
+        if new_name == self._lookup(deck_id)["name"]:
+            return None
+        if new_name in self._by_name:
+            return "同名デッキが既に存在します"
+        d = self._writable(deck_id)
+        del self._by_name[d["name"]]
+        d["name"] = new_name
+        self._by_name[new_name] = deck_id
+        return None
+
+    def merge(self, src_id: int, dst_id: int) -> Optional[str]:
+        src, dst = self.resolve(src_id), self.resolve(dst_id)
+        if self._lookup(src) is None or self._lookup(dst) is None:
+            return "デッキが見つかりません"
+        if src == dst:
+            return "同じデッキは統合できません"
+        d = self._writable(src)
+        if self._by_name.get(d["name"]) == src:
+            del self._by_name[d["name"]]
+        d["merged_into"] = dst
+        return None
+
+    def archive(self, deck_id: int) -> Optional[str]:
+        d = self._writable(deck_id)
+        if d is None:
+            return "デッキが見つかりません"
+        if self._by_name.get(d["name"]) == deck_id:
+            del self._by_name[d["name"]]
+        d["archived"] = True
+        return None
+
+    # ---- 取り消し用（操作ログから呼ぶ。直前の操作を戻す前提）
+    def remove_last(self, deck_id: int) -> None:
+        """add の取り消し。id は再利用しない（next_id は戻さない）。"""
+        assert self._added and self._added[-1] == deck_id
+        self._added.pop()
+        d = self._own.pop(deck_id)
+        if self._by_name.get(d["name"]) == deck_id:
+            del self._by_name[d["name"]]
+
+    def unarchive(self, deck_id: int) -> None:
+        d = self._writable(deck_id)
+        d.pop("archived", None)
+        if self._visible(d):
+            self._by_name[d["name"]] = deck_id
+
+    def unmerge(self, deck_id: int) -> None:
+        d = self._writable(deck_id)
+        d.pop("merged_into", None)
+        if self._visible(d):
+            self._by_name[d["name"]] = deck_id
+
+    # ---- 保存用の差分
+    def to_overlay(self) -> Dict[str, Any]:
+        patch = {}
+        for deck_id, d in self._own.items():
+            base = _BASE_BY_ID.get(deck_id)
+            if base is not None:
+                diff = _diff(base, d)
+                if diff:
+                    patch[str(deck_id)] = diff
+        return {
+            "base_version": BASE_CATALOG_VERSION,
+            "added": [self._own[i] for i in self._added],
+            "patch": patch,
+            "next_id": self.next_id,
+        }
+
+
+# =============================
+# 移行（v1: デッキ名参照 → v2: id参照）
+# =============================
+def _migrate_v1(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    v1 の tracker_*.json（戦績がデッキ名と *_class を持つ形式）を v2 に変換する。
+    初期デッキと同名なら初期デッキの id を使い、カタログに無い名前（削除済み）は
+    アーカイブ済みデッキとして復元する。
+    """
+    initial_ids = {d["name"]: d["id"] for d in INITIAL_DECKS}
+    next_id = max(initial_ids.values(), default=0) + 1
+    decks: List[Dict[str, Any]] = []
+    by_name: Dict[str, int] = {}
+
+    def new_id(name: str) -> int:
+        nonlocal next_id
+        if name in initial_ids:
+            return initial_ids[name]
+        next_id += 1
+        return next_id - 1
+
+    for d in data.get("deck_types") or []:
+        name = d.get("name")
+        if not name or name in by_name:
+            continue
+        deck_id = new_id(name)
+        by_name[name] = deck_id
+        decks.append({"id": deck_id, "name": name, "class": d.get("class", "E")})
+
+    def ref(name: Optional[str], cls: Optional[str]) -> Optional[int]:
+        if not name:
+            return None
+        if name not in by_name:
+            deck_id = new_id(name)
+            by_name[name] = deck_id
+            decks.append({"id": deck_id, "name": name, "class": cls or "E", "archived": True})
+        return by_name[name]
+
+    matches = []
+    for m in data.get("matches") or []:
+        matches.append({
+            "id": m.get("id"),
+            "my_deck_id": ref(m.get("my_deck"), m.get("my_deck_class")),
+            "opponent_deck_id": ref(m.get("opponent_deck"), m.get("opponent_deck_class")),
+            "result": m.get("result"),
+            "timestamp": m.get("timestamp"),
+        })
+
+    out = dict(data)
+    out["schema"] = 2
+    out["deck_types"] = decks
+    out["next_deck_id"] = next_id
+    out["matches"] = matches
+    out["my_deck"] = by_name.get(data.get("my_deck") or "")
+    out["current_opponent"] = by_name.get(data.get("current_opponent") or "")
+    out["stats_mydeck_filter"] = by_name.get(data.get("stats_mydeck_filter") or "")
+    return out
+
+
+# =============================
+# 移行（v2: デッキ一覧を丸ごと保存 → v3: ベースとの差分だけ保存）
+# =============================
+def _migrate_v2(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    ベースにある id は差分（改名・アーカイブ等）に、それ以外は USER_DECK_ID_START からの
+    id に振り直して「追加」にする。一覧に無いベースのデッキは削除済みとしてアーカイブ。
+    """
+    renumber: Dict[int, int] = {}
+    added: List[Dict[str, Any]] = []
+    patch: Dict[str, Dict[str, Any]] = {}
+    seen = set()
+    next_id = USER_DECK_ID_START
+
+    for d in data.get("deck_types") or []:
+        deck_id = d.get("id")
+        base = _BASE_BY_ID.get(deck_id)
+        if base is not None:
+            seen.add(deck_id)
+            diff = _diff(base, d)
+            if diff:
+                patch[str(deck_id)] = diff
+        else:
+            renumber[deck_id] = next_id
+            added.append(dict(d, id=next_id))
+            next_id += 1
+    for deck_id in _BASE_BY_ID:
+        if deck_id not in seen:
+            patch[str(deck_id)] = {"archived": True}
+
+    for d in added + list(patch.values()):
+        if d.get("merged_into") is not None:
+            d["merged_into"] = renumber.get(d["merged_into"], d["merged_into"])
+
+    out = {k: v for k, v in data.items() if k not in ("deck_types", "next_deck_id")}
+    if renumber:
+        out["matches"] = [
+            dict(m, my_deck_id=renumber.get(m.get("my_deck_id"), m.get("my_deck_id")),
+                 opponent_deck_id=renumber.get(m.get("opponent_deck_id"), m.get("opponent_deck_id")))
+            for m in data.get("matches") or []
+        ]
+        for k in ("my_deck", "current_opponent", "stats_mydeck_filter"):
+            out[k] = renumber.get(data.get(k), data.get(k))
+    out["deck_overlay"] = {
+        "base_version": BASE_CATALOG_VERSION,
+        "added": added,
+        "patch": patch,
+        "next_id": next_id,
+    }
+    out["schema"] = 3
+    return out
+
+
+def migrate_state(data: Dict[str, Any]) -> Dict[str, Any]:
+    """古い形式の tracker_*.json を順に今の形式へ変換する。"""
+    if data.get("schema", 1) < 2:
+        data = _migrate_v1(data)
+    if data.get("schema") < 3:
+        data = _migrate_v2(data)
+    return data
@@ -1,22 +1,76 @@
 # github_kv.py
 import base64
+import codecs
+import hashlib
+import http.client
 import json
+import os
+import threading
 import time
 import urllib.error
 import urllib.request
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
 
 import streamlit as st
 
-API_BASE = "https://api.github.com"
+import metrics
+
+# 環境変数があれば secrets より優先（負荷試験でローカルのAPIスタブに向ける用）
+API_BASE = os.environ.get("GITHUB_API_BASE", "https://api.github.com").rstrip("/")
+
+# path -> 最後に確認したリモートの blob sha（プロセス共通）
+_known_sha: Dict[str, str] = {}
+_sha_lock = threading.Lock()
+
+# contents API は 1MB を超えるファイルの content を返さない / 受け付けない。
+# これを超えるものは Git Data API（blob + tree + commit）で読み書きする。
+LARGE_FILE_BYTES = 900 * 1024
+RAW_MEDIA_TYPE = "application/vnd.github.raw"
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+# 操作（op）ごと: get_read=読み込み / get_sha=保存前の sha 取得 / put=保存 / git_*=大きいファイルの保存
+metrics.describe("github_kv_request_seconds", "histogram",
+                 "GitHub API latency by operation (seconds, including body transfer).", metrics.LATENCY_BUCKETS)
+metrics.describe("github_kv_response_bytes", "histogram",
+                 "GitHub API response body size by operation.", metrics.SIZE_BUCKETS)
+metrics.describe("github_kv_request_bytes", "histogram",
+                 "Request body size sent to GitHub by operation.", metrics.SIZE_BUCKETS)
+metrics.describe("github_kv_responses_total", "counter",
+                 "GitHub API responses by operation and HTTP status (code=\"error\" when no response).")
+metrics.describe("github_kv_write_retries_total", "counter", "write_json attempts after the first one.")
+metrics.describe("github_kv_write_failures_total", "counter", "write_json calls that gave up after all retries.")
+metrics.describe("github_kv_skipped_writes_total", "counter", "Writes skipped because the remote already had the same blob.")
+metrics.describe("github_kv_read_errors_total", "counter", "Reads that failed with something other than 404.")
+metrics.describe("github_kv_write_conflicts_total", "counter", "Writes rejected because the remote moved past base_sha.")
+
+
+class ReadError(Exception):
+    """404 以外の理由で読めなかった（空データとして扱うと上書き事故になる）"""
+
+
+class WriteConflict(Exception):
+    """元にした sha からリモートが進んでいた（読み直して合わせてから送り直す）"""
+
+
+# write_json の base_sha の既定値: 送る直前のリモートの sha を取って上書きする（競合を検出しない）
+OVERWRITE = "*"
+
+
+def _secret(key: str, default: Optional[str] = None) -> str:
+    if key in os.environ:
+        return os.environ[key]
+    if default is None:
+        return st.secrets[key]
+    return st.secrets.get(key, default)
 
 
 def _cfg() -> Tuple[str, str, str, str, str]:
-    token = st.secrets["GITHUB_TOKEN"]
-    owner = st.secrets["GITHUB_OWNER"]
-    repo = st.secrets["GITHUB_REPO"]
-    branch = st.secrets.get("GITHUB_BRANCH", "main")
-    data_dir = st.secrets.get("GITHUB_DATA_DIR", "data").strip("/")
+    token = _secret("GITHUB_TOKEN")
+    owner = _secret("GITHUB_OWNER")
+    repo = _secret("GITHUB_REPO")
+    branch = _secret("GITHUB_BRANCH", "main")
+    data_dir = _secret("GITHUB_DATA_DIR", "data").strip("/")
     return token, owner, repo, branch, data_dir
 
 
@@ -24,21 +78,30 @@ def _contents_url(owner: str, repo: str, path: str) -> str:
     return f"{API_BASE}/repos/{owner}/{repo}/contents/{path}"
 
 
-def _req(method: str, url: str, token: str, payload: Optional[dict] = None) -> dict:
+def _git_url(owner: str, repo: str, tail: str) -> str:
+    return f"{API_BASE}/repos/{owner}/{repo}/git/{tail}"
+
+
+def _open(method: str, url: str, token: str, payload: Optional[dict] = None,
+          accept: str = "application/vnd.github+json",
+          body: Optional[Tuple[Iterable[bytes], int]] = None):
+    """body=(チャンク, 長さ) なら payload の代わりにそのまま流す（大きい本文を1つの文字列にしない）。"""
     headers = {
         "Authorization": f"token {token}",
-        "Accept": "application/vnd.github+json",
+        "Accept": accept,
         "User-Agent": "streamlit-app",
     }
     data = None
     if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
         headers["Content-Type"] = "application/json"
+    elif body is not None:
+        data = body[0]
+        headers["Content-Type"] = "application/json"
+        headers["Content-Length"] = str(body[1])
 
     req = urllib.request.Request(url, data=data, headers=headers, method=method)
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        body = resp.read().decode("utf-8")
-        return json.loads(body) if body else {}
+    return urllib.request.urlopen(req, timeout=30)
 
 
 def _safe_http_code(e: Exception) -> Optional[int]:
@@ -47,59 +110,341 @@ def _safe_http_code(e: Exception) -> Optional[int]:
     return None
 
 
-def read_json(path: str) -> Optional[Dict[str, Any]]:
+def _observe(op: str, t0: float, status: Any, nbytes: Optional[int] = None) -> None:
+    # status は HTTP ステータスか例外（応答が無ければ "error"）
+    if isinstance(status, Exception):
+        status = _safe_http_code(status) or "error"
+    metrics.observe("github_kv_request_seconds", time.perf_counter() - t0, op=op)
+    metrics.inc("github_kv_responses_total", op=op, code=status)
+    if nbytes is not None:
+        metrics.observe("github_kv_response_bytes", nbytes, op=op)
+
+
+def _req(method: str, url: str, token: str, payload: Optional[dict] = None, op: str = "other",
+         body: Optional[Tuple[Iterable[bytes], int]] = None) -> dict:
+    t0 = time.perf_counter()
+    try:
+        with _open(method, url, token, payload, body=body) as resp:
+            status = resp.status
+            body = resp.read()
+    except Exception as e:
+        _observe(op, t0, e)
+        raise
+    _observe(op, t0, status, len(body))
+    return json.loads(body.decode("utf-8")) if body else {}
+
+
+def _remember_sha(path: str, sha: Optional[str]) -> None:
+    with _sha_lock:
+        if sha:
+            _known_sha[path] = sha
+        else:
+            _known_sha.pop(path, None)
+
+
+def known_sha(path: str) -> Optional[str]:
+    with _sha_lock:
+        return _known_sha.get(path)
+
+
+def skipped_writes() -> int:
+    return int(metrics.value("github_kv_skipped_writes_total"))
+
+
+def git_blob_sha(raw: bytes) -> str:
+    # git hash-object と同じ（GitHubの contents API が返す sha と一致する）
+    return hashlib.sha1(b"blob %d\0" % len(raw) + raw).hexdigest()
+
+
+class _JsonStream:
+    """
+    トップレベルがオブジェクトの JSON を少しずつ読む。
+    配列のフィールド（matches）は要素ごとに返すので、全体の文字列を持たない。
+    """
+
+    _WS = " \t\r\n"
+    _DELIMS = _WS + ",:]}"  # 値の直後に来てよい文字
+
+    def __init__(self, fp, on_bytes=None):
+        self._fp = fp
+        self._on_bytes = on_bytes
+        self._dec = codecs.getincrementaldecoder("utf-8")()
+        self._dj = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._fp.read(STREAM_CHUNK_BYTES)
+        if self._on_bytes and chunk:
+            self._on_bytes(chunk)
+        if not chunk:
+            self._eof = True
+            self._buf = self._buf[self._pos:] + self._dec.decode(b"", final=True)
+        else:
+            self._buf = self._buf[self._pos:] + self._dec.decode(chunk)
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self._WS:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("unexpected end of JSON")
+
+    def _expect(self, ch: str) -> None:
+        if self._peek() != ch:
+            raise ValueError(f"expected {ch!r} at {self._pos}")
+        self._pos += 1
+
+    def _value(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                obj, end = self._dj.raw_decode(self._buf, self._pos)
+                # チャンクの境目で切れた数値（"0." や "1e" の手前まで）を確定しないよう、
+                # 直後が区切り文字か EOF のときだけ受け取る
+                if end < len(self._buf) and self._buf[end] in self._DELIMS or \
+                        end == len(self._buf) and self._eof:
+                    self._pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            if not self._fill():
+                raise ValueError(f"unexpected character after value at {end}")
+
+    def events(self) -> Iterator[Tuple[str, str, Any]]:
+        """("field", key, value) と、配列フィールドの要素ごとの ("item", key, value) を返す。"""
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if self._peek() == "[":
+                self._pos += 1
+                yield "field", key, []
+                if self._peek() != "]":
+                    while True:
+                        yield "item", key, self._value()
+                        if self._peek() == ",":
+                            self._pos += 1
+                            continue
+                        break
+                self._expect("]")
+            else:
+                yield "field", key, self._value()
+            if self._peek() == ",":
+                self._pos += 1
+                continue
+            self._expect("}")
+            return
+
+
+def iter_document(path: str) -> Iterator[Tuple[str, str, Any]]:
+    """
+    GitHub上の JSON を raw で受け取りながら少しずつ返す。
+    ("field", key, value) → 配列は ("field", key, []) の後に ("item", key, 要素) が続く。
+    最後に ("sha", "", blob sha)。ファイルが無ければ何も返さない。404以外の失敗は ReadError。
+    """
     token, owner, repo, branch, _ = _cfg()
     url = _contents_url(owner, repo, path) + f"?ref={branch}"
+    t0 = time.perf_counter()
     try:
-        res = _req("GET", url, token)
-    except Exception:
-        return None
+        resp = _open("GET", url, token, accept=RAW_MEDIA_TYPE)
+    except Exception as e:
+        _observe("get_read", t0, e)
+        if _safe_http_code(e) == 404:
+            return
+        metrics.inc("github_kv_read_errors_total")
+        raise ReadError(f"GitHubから読み込めませんでした: {path}") from e
+
+    with resp:
+        # 受け取りながら blob sha を計算する（長さが分からなければ ETag を使う）
+        length = resp.headers.get("Content-Length")
+        hasher = hashlib.sha1(b"blob %d\0" % int(length)) if length else None
+        received = 0
 
-    content_b64 = res.get("content")
-    if not content_b64:
+        def on_bytes(chunk: bytes) -> None:
+            nonlocal received
+            received += len(chunk)
+            if hasher:
+                hasher.update(chunk)
+
+        try:
+            yield from _JsonStream(resp, on_bytes).events()
+            # パーサが読まなかった末尾（改行など）も sha に含める
+            for chunk in iter(lambda: resp.read(STREAM_CHUNK_BYTES), b""):
+                on_bytes(chunk)
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            # 本文の途中で切れた応答は IncompleteRead（HTTPException）になる
+            _observe("get_read", t0, e)
+            metrics.inc("github_kv_read_errors_total")
+            raise ReadError(f"GitHubから読み込めませんでした: {path}") from e
+        _observe("get_read", t0, resp.status, received)
+        if hasher:
+            sha = hasher.hexdigest()
+        else:
+            sha = (resp.headers.get("ETag") or "").replace("W/", "").strip('"') or None
+    _remember_sha(path, sha)
+    yield "sha", "", sha
+
+
+def read_json_with_sha(path: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    (data, sha) を返す。ファイルが無い場合は (None, None)、404以外の失敗は ReadError。
+    本文は raw で受け取りながら組み立てる（base64・文字列の全体コピーを作らない）。
+    """
+    data: Optional[Dict[str, Any]] = None
+    sha = None
+    for kind, key, value in iter_document(path):
+        if data is None:
+            data = {}
+        if kind == "field":
+            data[key] = value
+        elif kind == "item":
+            data[key].append(value)
+        else:
+            sha = value
+    return data, sha
+
+
+def read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        return read_json_with_sha(path)[0]
+    except ReadError:
         return None
-    raw = base64.b64decode(content_b64).decode("utf-8")
-    return json.loads(raw)
 
 
-def write_json(path: str, data: Dict[str, Any], message: str) -> bool:
+def _blob_body(raw: bytes) -> Tuple[Iterator[bytes], int]:
+    """blobs API の本文 {"encoding": "base64", "content": ...} を少しずつ作る。戻り値は (チャンク, 長さ)。"""
+    head = b'{"encoding": "base64", "content": "'
+    tail = b'"}'
+    step = STREAM_CHUNK_BYTES // 4 * 3  # base64 は3バイト単位で区切れば連結してもそのまま使える
+    view = memoryview(raw)
+
+    def chunks() -> Iterator[bytes]:
+        yield head
+        for i in range(0, len(raw), step):
+            yield base64.b64encode(view[i:i + step])
+        yield tail
+
+    return chunks(), len(head) + 4 * ((len(raw) + 2) // 3) + len(tail)
+
+
+def _upload_blob(raw: bytes, token: str, owner: str, repo: str) -> str:
+    """Git Data API に blob を送る（本文は流しながら送る）。戻り値は blob sha。"""
+    metrics.observe("github_kv_request_bytes", len(raw), op="git_blob")
+    blob = _req("POST", _git_url(owner, repo, "blobs"), token, op="git_blob", body=_blob_body(raw))
+    return blob["sha"]
+
+
+def _commit_blob(path: str, blob_sha: str, message: str,
+                 token: str, owner: str, repo: str, branch: str) -> None:
+    """
+    送信済みの blob で1ファイルだけ差し替えるコミットを作る。
+    ブランチが先に進んでいたら ref 更新が 422 になる（呼び出し側で再試行。blob は送り直さない）。
+    """
+    ref = _req("GET", _git_url(owner, repo, f"ref/heads/{branch}"), token, op="git_ref")
+    parent = ref["object"]["sha"]
+    commit = _req("GET", _git_url(owner, repo, f"commits/{parent}"), token, op="git_get_commit")
+    tree = _req("POST", _git_url(owner, repo, "trees"), token, {
+        "base_tree": commit["tree"]["sha"],
+        "tree": [{"path": path, "mode": "100644", "type": "blob", "sha": blob_sha}],
+    }, op="git_tree")
+    new_commit = _req("POST", _git_url(owner, repo, "commits"), token, {
+        "message": message,
+        "tree": tree["sha"],
+        "parents": [parent],
+    }, op="git_commit")
+    _req("PATCH", _git_url(owner, repo, f"refs/heads/{branch}"), token, {"sha": new_commit["sha"]},
+         op="git_update_ref")
+
+
+def write_json(path: str, data: Dict[str, Any], message: str, notify: bool = True,
+               base_sha: Optional[str] = OVERWRITE) -> bool:
     """
     成功: True
     失敗: False（画面にHTTPコードを表示してアプリは落とさない）
+    notify=False ならエラー表示しない（バックグラウンドスレッド用）
+    base_sha: data の元にしたリモートの blob sha（None=まだファイルが無かった）。
+              リモートがそこから進んでいたら送らずに WriteConflict（409 も同じ扱い）
     """
     token, owner, repo, branch, _ = _cfg()
     url = _contents_url(owner, repo, path)
 
-    raw = json.dumps(data, ensure_ascii=False, indent=2)
-    content = base64.b64encode(raw.encode("utf-8")).decode("utf-8")
+    raw = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+    # 最後に確認したリモートと同じ内容なら何もしない（別セッションからの同一内容も含む）
+    with _sha_lock:
+        skip = _known_sha.get(path) == git_blob_sha(raw)
+    if skip:
+        metrics.inc("github_kv_skipped_writes_total")
+        return True
+
+    large = len(raw) > LARGE_FILE_BYTES
+    content = None if large else base64.b64encode(raw).decode("utf-8")
 
     last_code = None
+    blob_sha = None  # 大きいファイル: 送った blob は再試行でも使い回す
 
-    for _ in range(3):
+    for attempt in range(3):
+        if attempt:
+            metrics.inc("github_kv_write_retries_total")
         try:
-            # sha取得（存在しない場合は新規作成）
-            current = None
-            try:
-                current = _req("GET", url + f"?ref={branch}", token)
-            except Exception as e:
-                # 404なら新規作成扱いでOK、他はコード記録
-                code = _safe_http_code(e)
-                if code and code != 404:
-                    last_code = code
+            sha = base_sha
+            if large or base_sha == OVERWRITE:
+                # sha取得（存在しない場合は新規作成）
                 current = None
+                try:
+                    current = _req("GET", url + f"?ref={branch}", token, op="get_sha")
+                except Exception as e:
+                    # 404なら新規作成扱いでOK、他はコード記録
+                    code = _safe_http_code(e)
+                    if code and code != 404:
+                        last_code = code
+                        raise
+                    current = None
+                sha = (current or {}).get("sha")
+                if base_sha != OVERWRITE and sha != base_sha:
+                    raise WriteConflict(path)
+
+            if large:
+                # 確認から ref 更新までに別の書き込みが入ったら ref 更新が 422 になり、次の周回で確認し直す
+                if blob_sha is None:
+                    blob_sha = _upload_blob(raw, token, owner, repo)
+                _commit_blob(path, blob_sha, message, token, owner, repo, branch)
+                _remember_sha(path, blob_sha)
+                return True
 
             payload = {
                 "message": message,
                 "content": content,
                 "branch": branch,
             }
-            sha = (current or {}).get("sha")
             if sha:
                 payload["sha"] = sha
 
-            _req("PUT", url, token, payload)
+            metrics.observe("github_kv_request_bytes", len(raw), op="put")
+            try:
+                res = _req("PUT", url, token, payload, op="put")
+            except Exception as e:
+                # 409: sha が古い / 422: sha なしで送ったがファイルがあった
+                if base_sha != OVERWRITE and _safe_http_code(e) in (409, 422):
+                    raise WriteConflict(path) from e
+                raise
+            _remember_sha(path, (res.get("content") or {}).get("sha"))
             return True
 
+        except WriteConflict:
+            metrics.inc("github_kv_write_conflicts_total")
+            raise
         except Exception as e:
             code = _safe_http_code(e)
             if code:
@@ -107,6 +452,9 @@ def write_json(path: str, data: Dict[str, Any], message: str) -> bool:
             time.sleep(0.5)
 
     # 失敗したがアプリは落とさない
+    metrics.inc("github_kv_write_failures_total")
+    if not notify:
+        return False
     if last_code:
         st.error(f"GitHub保存に失敗しました（HTTP {last_code}）")
     else:
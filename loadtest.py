@@ -0,0 +1,392 @@
+# loadtest.py
+# 同時接続の負荷試験。
+# GitHub contents API を真似たローカルサーバを立てて、アプリと同じ
+# store（poll_state / add_match / save。app.py と同じ関数）→ local_cache → github_kv の経路を
+# N ユーザーぶん並行に動かし、スループット・保存レイテンシ・失敗率を出す。
+#
+#   python loadtest.py --users 50 --matches 20 --latency-ms 300 --conflict-rate 0.05 --rate-limit 5000
+#
+# --mode journal : 今のアプリと同じ（ジャーナル → 書き込みスレッド）。保存〜GitHub反映までを計測
+# --mode direct  : 各セッションが write_json を同期で呼ぶ（GitHub API 経路そのものを計測）
+import argparse
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import unquote, urlparse
+
+
+CONTENTS_API_MAX_BYTES = 1024 * 1024
+
+
+def git_blob_sha(raw: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(raw) + raw).hexdigest()
+
+
+# =============================
+# GitHub contents API スタブ
+# =============================
+class FakeGitHub:
+    def __init__(self, latency_ms: float, jitter_ms: float, conflict_rate: float, rate_limit: int, seed: int):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.conflict_rate = conflict_rate
+        self.rate_limit = rate_limit  # 1分あたりのリクエスト上限（0=無制限）
+        self.files: Dict[str, Tuple[bytes, str]] = {}
+        self.blobs: Dict[str, bytes] = {}
+        self.trees: Dict[str, Dict[str, str]] = {}
+        self.commits: Dict[str, dict] = {"commit00000000": {"tree": None, "parent": None}}
+        self.head = "commit00000000"
+        self._seq = 0
+        self.status = Counter()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def _sleep(self) -> None:
+        with self._lock:
+            jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+
+    def _rate_limited(self) -> bool:
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 60:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            return self._window_count > self.rate_limit
+
+    def _roll_conflict(self) -> bool:
+        with self._lock:
+            return self._rng.random() < self.conflict_rate
+
+    def handle(self, method: str, path: str, body: Optional[bytes],
+               accept: str = "") -> Tuple[int, Union[dict, bytes]]:
+        self._sleep()
+        if self._rate_limited():
+            return 403, {"message": "API rate limit exceeded"}
+
+        if "/git/" in path:
+            return self._handle_git(method, path.split("/git/", 1)[1], body)
+
+        parts = path.split("/contents/", 1)
+        if len(parts) != 2:
+            return 404, {"message": "Not Found"}
+        key = unquote(parts[1])
+
+        if method == "GET":
+            with self._lock:
+                hit = self.files.get(key)
+            if hit is None:
+                return 404, {"message": "Not Found"}
+            raw, sha = hit
+            if accept == "application/vnd.github.raw":
+                return 200, raw
+            if len(raw) > CONTENTS_API_MAX_BYTES:
+                # 本物と同じく 1MB 超は content を返さない
+                return 200, {"path": key, "sha": sha, "size": len(raw), "encoding": "none", "content": ""}
+            return 200, {
+                "path": key,
+                "sha": sha,
+                "size": len(raw),
+                "encoding": "base64",
+                "content": base64.b64encode(raw).decode("ascii"),
+            }
+
+        if method == "PUT":
+            payload = json.loads(body or b"{}")
+            if self._roll_conflict():
+                return 409, {"message": "is at ... but expected ..."}
+            raw = base64.b64decode(payload.get("content", ""))
+            sha = git_blob_sha(raw)
+            with self._lock:
+                hit = self.files.get(key)
+                if hit is not None and payload.get("sha") != hit[1]:
+                    return (409, {"message": "sha mismatch"}) if payload.get("sha") else \
+                        (422, {"message": "\"sha\" wasn't supplied."})
+                self.files[key] = (raw, sha)
+                self.blobs[sha] = raw
+                self._advance_head({key: sha})
+            return (200 if hit else 201), {"content": {"path": key, "sha": sha}}
+
+        return 405, {"message": "Method Not Allowed"}
+
+    # ---- Git Data API（大きいファイルの読み書き用。ツリーは差分だけ持つ）
+    def _advance_head(self, entries: Dict[str, str]) -> str:
+        self._seq += 1
+        tree = f"tree{self._seq:08d}"
+        commit = f"commit{self._seq:08d}"
+        self.trees[tree] = dict(entries)
+        self.commits[commit] = {"tree": tree, "parent": self.head}
+        self.head = commit
+        return commit
+
+    def _handle_git(self, method: str, rest: str, body: Optional[bytes]) -> Tuple[int, Union[dict, bytes]]:
+        payload = json.loads(body or b"{}") if body else {}
+        with self._lock:
+            if method == "GET" and rest.startswith("blobs/"):
+                raw = self.blobs.get(rest[len("blobs/"):])
+                return (200, raw) if raw is not None else (404, {"message": "Not Found"})
+            if method == "POST" and rest == "blobs":
+                content = payload.get("content", "")
+                raw = base64.b64decode(content) if payload.get("encoding") == "base64" else content.encode("utf-8")
+                sha = git_blob_sha(raw)
+                self.blobs[sha] = raw
+                return 201, {"sha": sha}
+            if method == "GET" and rest.startswith("ref/heads/"):
+                return 200, {"object": {"sha": self.head, "type": "commit"}}
+            if method == "GET" and rest.startswith("commits/"):
+                c = self.commits.get(rest[len("commits/"):])
+                return (200, {"tree": {"sha": c["tree"]}}) if c else (404, {"message": "Not Found"})
+            if method == "POST" and rest == "trees":
+                self._seq += 1
+                tree = f"tree{self._seq:08d}"
+                self.trees[tree] = {e["path"]: e["sha"] for e in payload.get("tree", [])}
+                return 201, {"sha": tree}
+            if method == "POST" and rest == "commits":
+                self._seq += 1
+                commit = f"commit{self._seq:08d}"
+                self.commits[commit] = {"tree": payload["tree"], "parent": payload["parents"][0]}
+                return 201, {"sha": commit}
+            if method == "PATCH" and rest.startswith("refs/heads/"):
+                c = self.commits.get(payload.get("sha"))
+                if c is None:
+                    return 422, {"message": "Object does not exist"}
+                if c["parent"] != self.head:
+                    return 422, {"message": "Update is not a fast forward"}
+                for key, sha in self.trees.get(c["tree"], {}).items():
+                    self.files[key] = (self.blobs[sha], sha)
+                self.head = payload["sha"]
+                return 200, {"object": {"sha": self.head}}
+        return 404, {"message": "Not Found"}
+
+
+def serve(fake: FakeGitHub) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def _do(self, method: str) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else None
+            code, obj = fake.handle(method, urlparse(self.path).path, body, self.headers.get("Accept", ""))
+            with fake._lock:
+                fake.status[f"{method} {code}"] += 1
+            raw = isinstance(obj, bytes)
+            out = obj if raw else json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/octet-stream" if raw else "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            if code == 403:
+                self.send_header("X-RateLimit-Remaining", "0")
+            self.end_headers()
+            self.wfile.write(out)
+
+        def do_GET(self) -> None:
+            self._do("GET")
+
+        def do_PUT(self) -> None:
+            self._do("PUT")
+
+        def do_POST(self) -> None:
+            self._do("POST")
+
+        def do_PATCH(self) -> None:
+            self._do("PATCH")
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# =============================
+# 仮想ユーザー
+# =============================
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.load_ms: List[float] = []
+        self.save_ms: List[float] = []
+        self.save_failed = 0
+        self.load_failed = 0  # 読み込みで失敗したユーザー数（その分の保存は行われない）
+        self.errors = Counter()
+
+
+def run_user(i: int, args, results: Results) -> None:
+    # アプリ側モジュールは環境変数を設定してから読み込む（main 参照）
+    import github_kv
+    import local_cache
+    import store
+    from ranking import count_by, rank, remap
+
+    rng = random.Random(args.seed + i)
+    uid = f"load_{i:04d}"
+    path = store.user_data_path(uid)
+
+    # ログイン時と同じく poll_state で待つ（アプリは LOAD_POLL_SEC ごとに聞き直す。ここは待ちながら聞き直す）
+    t = time.perf_counter()
+    try:
+        data = store.poll_state(path, store.LOAD_WAIT_SEC)
+        while data is None and time.perf_counter() - t < args.save_timeout:
+            data = store.poll_state(path, store.LOAD_POLL_SEC)
+        if data is None:
+            raise TimeoutError(path)
+    except Exception as e:
+        with results.lock:
+            results.errors[f"load:{type(e).__name__}"] += 1
+            results.load_failed += 1
+        return
+    with results.lock:
+        results.load_ms.append((time.perf_counter() - t) * 1000)
+
+    state: Dict[str, Any] = {}
+    store.apply_state(state, data)
+    deck_ids = [d["id"] for d in state["catalog"].active()]
+    state["my_deck"] = rng.choice(deck_ids)
+
+    for _ in range(args.matches):
+        time.sleep(rng.uniform(0, args.think_ms) / 1000)
+        # 再描画のたびにアプリが受け取るリモートの変更（保存時の合わせ直しの結果など）
+        remote = store.take_update(path)
+        if remote is not None:
+            store.apply_state(state, remote)
+        # 対戦相手を選んで勝敗ボタン（app.add_match と同じ手順）
+        state["current_opponent"] = rng.choice(deck_ids)
+        store.add_match(state, store.new_match(state["my_deck"], state["current_opponent"],
+                                               rng.choice(["win", "loss"])))
+        # 集計タブの Top3 と同じ計算
+        rank(remap(count_by(state["matches"], lambda m: m["my_deck_id"]), state["catalog"].resolve), k=3)
+
+        # app.save_data と同じ手順
+        t = time.perf_counter()
+        try:
+            if args.mode == "journal":
+                store.save(state, path, uid)
+                ok = local_cache.wait_synced(path, args.save_timeout)
+            else:
+                ok = github_kv.write_json(path, store.state_document(state),
+                                          message=f"Update tracker for {uid}", notify=False)
+        except Exception as e:
+            ok = False
+            with results.lock:
+                results.errors[type(e).__name__] += 1
+        with results.lock:
+            results.save_ms.append((time.perf_counter() - t) * 1000)
+            if not ok:
+                results.save_failed += 1
+
+
+def seed_history(fake: FakeGitHub, args) -> None:
+    from decks import INITIAL_DECKS
+    import store
+
+    rng = random.Random(args.seed)
+    deck_ids = [d["id"] for d in INITIAL_DECKS]
+    for i in range(args.users):
+        doc = store.default_state()
+        doc["matches"] = [
+            {"id": 1_700_000_000_000 + n, "my_deck_id": rng.choice(deck_ids),
+             "opponent_deck_id": rng.choice(deck_ids), "result": rng.choice(["win", "loss"]),
+             "timestamp": "2026-01-01T00:00:00"}
+            for n in range(args.history)
+        ]
+        raw = json.dumps(doc, ensure_ascii=False, indent=2).encode("utf-8")
+        sha = git_blob_sha(raw)
+        fake.blobs[sha] = raw
+        fake.files[store.user_data_path(f"load_{i:04d}")] = (raw, sha)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = max(0, math.ceil(p / 100 * len(s)) - 1)  # nearest-rank
+    return s[k]
+
+
+def fmt_latency(values: List[float]) -> str:
+    return " ".join(f"p{p}={percentile(values, p):.0f}" for p in (50, 95, 99)) + \
+        f" max={max(values, default=0):.0f}"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="ShadowVerseWB_Tracker 同時接続負荷試験")
+    ap.add_argument("--users", type=int, default=20, help="同時ユーザー数")
+    ap.add_argument("--matches", type=int, default=10, help="1ユーザーあたりの記録数")
+    ap.add_argument("--think-ms", type=float, default=200, help="記録間の待ち時間（0〜この値の一様乱数）")
+    ap.add_argument("--mode", choices=["journal", "direct"], default="journal")
+    ap.add_argument("--latency-ms", type=float, default=150, help="スタブAPIの応答遅延")
+    ap.add_argument("--jitter-ms", type=float, default=50)
+    ap.add_argument("--conflict-rate", type=float, default=0.0, help="PUT が 409 を返す確率")
+    ap.add_argument("--rate-limit", type=int, default=0, help="1分あたりのリクエスト上限（超過で403）。0=無制限")
+    ap.add_argument("--save-timeout", type=float, default=120, help="journal モードで反映を待つ上限秒")
+    ap.add_argument("--history", type=int, default=0,
+                    help="各ユーザーに事前に入れておく戦績数（大きくすると1MB超の文書になる）")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+
+    fake = FakeGitHub(args.latency_ms, args.jitter_ms, args.conflict_rate, args.rate_limit, args.seed)
+    server = serve(fake)
+
+    os.environ["GITHUB_API_BASE"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["GITHUB_TOKEN"] = "loadtest"
+    os.environ["GITHUB_OWNER"] = "loadtest"
+    os.environ["GITHUB_REPO"] = "loadtest"
+    # 未設定だと st.secrets を見に行く（secrets.toml の無い環境では例外になる）
+    os.environ["GITHUB_BRANCH"] = "main"
+    os.environ["GITHUB_DATA_DIR"] = "data"
+    os.environ["TRACKER_DATA_DIR"] = tempfile.mkdtemp(prefix="tracker-loadtest-")
+    if args.history:
+        seed_history(fake, args)
+
+    results = Results()
+    threads = [threading.Thread(target=run_user, args=(i, args, results), daemon=True) for i in range(args.users)]
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - t0
+    server.shutdown()
+
+    # 読み込みに失敗したユーザーの分は、行えなかった保存として失敗に数える
+    saves = args.users * args.matches
+    failed = results.save_failed + results.load_failed * args.matches
+    ok = saves - failed
+    print(f"users={args.users} matches/user={args.matches} mode={args.mode} "
+          f"latency={args.latency_ms:.0f}±{args.jitter_ms:.0f}ms conflict={args.conflict_rate} "
+          f"rate_limit={args.rate_limit or '-'}/min")
+    print(f"elapsed: {elapsed:.1f}s  throughput: {ok / elapsed:.2f} saves/s")
+    print(f"saves: {saves}  ok={ok}  failed={failed} "
+          f"({(failed / saves * 100) if saves else 0:.1f}%)  users failed to load: {results.load_failed}")
+    print(f"save latency ms: {fmt_latency(results.save_ms)}")
+    print(f"load latency ms: {fmt_latency(results.load_ms)}")
+    import github_kv
+    import local_cache
+    import metrics
+    print(f"skipped writes (no-op): {github_kv.skipped_writes()}  "
+          f"write retries: {metrics.value('github_kv_write_retries_total'):.0f}")
+    metrics.write_textfile(local_cache.METRICS_FILE)
+    print(f"client metrics: {local_cache.METRICS_FILE}")
+    print("server: " + "  ".join(f"{k}={v}" for k, v in sorted(fake.status.items())))
+    if results.errors:
+        print("errors: " + "  ".join(f"{k}={v}" for k, v in results.errors.items()))
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
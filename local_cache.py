@@ -0,0 +1,379 @@
+# local_cache.py
+# GitHub上のユーザーデータをローカル（DATA_DIR）にキャッシュする。
+# - 読み込み: キャッシュを即返し、裏でGitHubと突き合わせる（read-through + revalidate）
+# - 書き込み: まずジャーナルに書いてから裏でGitHubへ送る（プロセス再起動後も再送）
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+from github_kv import ReadError, WriteConflict, known_sha, read_json_with_sha, write_json
+
+DATA_DIR = os.environ.get("TRACKER_DATA_DIR", "data")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+JOURNAL_DIR = os.path.join(DATA_DIR, "journal")
+# GitHub APIのメトリクス（Prometheus テキスト形式）の書き出し先
+METRICS_FILE = os.environ.get("TRACKER_METRICS_FILE", os.path.join(DATA_DIR, "metrics", "github_kv.prom"))
+
+RETRY_MIN_SEC = 2.0
+RETRY_MAX_SEC = 60.0
+CONFLICT_RETRIES = 3  # 1回の送信で競合→合わせ直しを繰り返す上限
+WRITER_THREADS = 4  # 1つの文書の送信失敗・遅延で他のユーザーの同期を止めない
+# load_async の結果を取りに来なかったときの保持時間（過ぎたら読み直す。古い文書で上書きしないため）
+LOAD_RESULT_TTL_SEC = 10.0
+
+# _lock はメモリ上の状態だけを守る（ファイルの読み書きは持たずに行う）
+_lock = threading.Lock()
+_wakeup = threading.Condition(_lock)
+_path_locks: Dict[str, threading.Lock] = {}  # path -> そのキャッシュ・ジャーナルを書き換えるときのロック
+_dirty: set = set()             # 送信待ちの path
+_gen: Dict[str, int] = {}       # path -> ローカル保存の世代（古い再検証結果を捨てる用）
+# path -> 画面側の状態の元になったリモートの sha（送るときにこれを付け、リモートが進んでいたら合わせ直す）
+_base: Dict[str, Optional[str]] = {}
+_updates: Dict[str, Tuple[Dict[str, Any], Optional[str]]] = {}  # path -> 届いたリモートの新データと sha
+_inflight: set = set()         # 書き込みスレッドが送信中の path
+_retry_at: Dict[str, float] = {}     # path -> 次に送ってよい時刻（失敗した path だけ。time.monotonic）
+_retry_delay: Dict[str, float] = {}  # path -> 直近のバックオフ秒
+_revalidating: set = set()
+_loading: set = set()           # load_async で読み込み中の path
+# path -> (世代, 読み終えた時刻, data, 例外)
+_loaded: Dict[str, Tuple[int, float, Optional[Dict[str, Any]], Optional[Exception]]] = {}
+_writers: List[threading.Thread] = []
+# 競合時に (元の文書 or None, こちら, リモート) から送り直す文書を作る（store が登録する）
+_merge: Optional[Callable[[Optional[Dict[str, Any]], Dict[str, Any], Dict[str, Any]], Dict[str, Any]]] = None
+
+
+def set_merge(fn: Callable[[Optional[Dict[str, Any]], Dict[str, Any], Dict[str, Any]], Dict[str, Any]]) -> None:
+    global _merge
+    _merge = fn
+
+
+def _key(path: str) -> str:
+    return path.strip("/").replace("/", "__")
+
+
+def _cache_file(path: str) -> str:
+    return os.path.join(CACHE_DIR, _key(path))
+
+
+def _journal_file(path: str) -> str:
+    return os.path.join(JOURNAL_DIR, _key(path))
+
+
+def _path_lock(path: str) -> threading.Lock:
+    with _lock:
+        return _path_locks.setdefault(path, threading.Lock())
+
+
+def _read_file(fp: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(fp, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_file(fp: str, obj: Dict[str, Any]) -> None:
+    # 途中で落ちても壊れないように tmp に書いてから置き換える
+    os.makedirs(os.path.dirname(fp), exist_ok=True)
+    tmp = f"{fp}.{threading.get_ident()}.tmp"  # 別スレッドの書きかけと混ざらないように
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, fp)
+
+
+def _remove_file(fp: str) -> None:
+    try:
+        os.remove(fp)
+    except FileNotFoundError:
+        pass
+
+
+# =============================
+# 読み込み
+# =============================
+def load(path: str) -> Optional[Dict[str, Any]]:
+    """
+    ローカルにあれば即返して裏で再検証する。
+    未送信のジャーナルがあればそれが最新。どちらも無ければGitHubから同期で読む。
+    GitHubが404以外で失敗したら ReadError（空データ扱いにすると次の保存で上書きしてしまう）。
+    """
+    start()
+    entry = _read_file(_journal_file(path))
+    if entry is not None:
+        with _lock:
+            _base.setdefault(path, entry.get("base_sha"))
+        return entry.get("data")
+
+    entry = _read_file(_cache_file(path))
+    if entry is not None:
+        with _lock:
+            _base[path] = entry.get("sha")
+        revalidate_async(path)
+        return entry.get("data")
+
+    data, sha = read_json_with_sha(path)
+    if data is not None:
+        with _path_lock(path):
+            _write_file(_cache_file(path), {"sha": sha, "data": data})
+    with _lock:
+        _base[path] = sha
+    return data
+
+
+def load_async(path: str) -> None:
+    """load を裏で始める（読み込み中・結果を取りに来る前なら何もしない）。結果は take_loaded で受け取る。"""
+    start()
+    with _lock:
+        _expire_loaded()
+        if path in _loading or path in _loaded:
+            return
+        _loading.add(path)
+        gen = _gen.get(path, 0)
+    threading.Thread(target=_load_bg, args=(path, gen), daemon=True).start()
+
+
+def _load_bg(path: str, gen: int) -> None:
+    data, err = None, None
+    try:
+        data = load(path)
+    except Exception as e:
+        err = e
+    with _lock:
+        _loading.discard(path)
+        _loaded[path] = (gen, time.monotonic(), data, err)
+        _wakeup.notify_all()
+
+
+def _expire_loaded() -> None:
+    # 途中で別のユーザー名に変えた・同時に開いた別セッションが先に受け取った、などで残ったもの
+    now = time.monotonic()
+    for path in [p for p, e in _loaded.items() if now - e[1] > LOAD_RESULT_TTL_SEC]:
+        del _loaded[path]
+
+
+def take_loaded(path: str, timeout: float = 0.0) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    load_async の結果を1回だけ返す: (読み終わったか, data)。timeout 秒までは待つ。
+    読み込みが失敗していたらその例外（ReadError）を投げる。
+    結果は取った時点で消えるので、取れなかった側は load_async からやり直す。
+    """
+    with _lock:
+        if timeout > 0:
+            _wakeup.wait_for(lambda: path in _loaded, timeout)
+        _expire_loaded()
+        entry = _loaded.pop(path, None)
+        # 読んでいる間にローカル保存があったら、読んだものは古い（ジャーナルから読み直す）
+        stale = entry is not None and entry[0] != _gen.get(path, 0)
+    if entry is None:
+        return False, None
+    if stale:
+        load_async(path)
+        return False, None
+    _, _, data, err = entry
+    if err is not None:
+        raise err
+    return True, data
+
+
+def revalidate_async(path: str) -> None:
+    with _lock:
+        if path in _revalidating:
+            return
+        _revalidating.add(path)
+        gen = _gen.get(path, 0)
+    threading.Thread(target=_revalidate, args=(path, gen), daemon=True).start()
+
+
+def _revalidate(path: str, gen: int) -> None:
+    try:
+        cached = _read_file(_cache_file(path)) or {}
+        try:
+            data, sha = read_json_with_sha(path)
+        except ReadError:
+            return  # 次回のログインで再検証する
+        if data is None or not sha or sha == cached.get("sha"):
+            return
+        with _path_lock(path):
+            with _lock:
+                # 読んでいる間にローカル保存があったら、そちらが新しい
+                if _gen.get(path, 0) != gen or path in _dirty:
+                    return
+            _write_file(_cache_file(path), {"sha": sha, "data": data})
+            with _lock:
+                if _gen.get(path, 0) == gen:
+                    _updates[path] = (data, sha)
+    finally:
+        with _lock:
+            _revalidating.discard(path)
+
+
+def take_update(path: str) -> Optional[Dict[str, Any]]:
+    """
+    再検証・競合の合わせ直しで届いたリモートの変更（あれば）を1回だけ返す。
+    受け取った時点で、次の保存はこの版を元にしたものとして送る。
+    """
+    with _lock:
+        update = _updates.pop(path, None)
+        if update is None:
+            return None
+        _base[path] = update[1]
+        return update[0]
+
+
+# =============================
+# 書き込み
+# =============================
+def save(path: str, data: Dict[str, Any], message: str) -> None:
+    """ジャーナル（先行書き込み）に書いて即戻る。GitHubへの送信は書き込みスレッドが行う。"""
+    start()
+    with _path_lock(path):
+        with _lock:
+            gen = _gen.get(path, 0) + 1
+            _gen[path] = gen
+            # 受け取られなかったリモートの変更は捨てる（元の sha は古いままなので、送るときに競合として合わせ直す）
+            _updates.pop(path, None)
+            base_sha = _base.get(path)
+        _write_file(_journal_file(path), {"path": path, "message": message, "gen": gen,
+                                          "base_sha": base_sha, "data": data})
+        with _lock:
+            _dirty.add(path)
+            _wakeup.notify_all()
+
+
+def is_pending(path: str) -> bool:
+    with _lock:
+        return path in _dirty
+
+
+def wait_synced(path: str, timeout: Optional[float] = None) -> bool:
+    """path の送信待ちが無くなるまで待つ。timeout 内に終われば True。"""
+    with _lock:
+        return _wakeup.wait_for(lambda: path not in _dirty, timeout)
+
+
+def _flush(path: str) -> bool:
+    entry = _read_file(_journal_file(path))
+    if entry is None:
+        with _lock:
+            _dirty.discard(path)
+            _wakeup.notify_all()
+        return True
+    with _lock:
+        base_sha = _base.get(path, entry.get("base_sha"))
+    data = entry["data"]
+    message = entry.get("message", "")
+    put_sha = base_sha
+    for _ in range(CONFLICT_RETRIES):
+        try:
+            ok = write_json(path, data, message=message, notify=False, base_sha=put_sha)
+            break
+        except WriteConflict:
+            # 元にした版からリモートが進んでいた: 今のリモートに重ねて送り直す（上書きはしない）
+            merged = _reconcile(path, entry["data"], base_sha)
+            if merged is None:
+                return False
+            data, put_sha = merged
+    else:
+        return False  # 競合が続いている（バックオフして次の周回で）
+    if not ok:
+        return False
+    sha = known_sha(path)
+    with _path_lock(path):  # 持っている間は save が世代を進められない
+        _write_file(_cache_file(path), {"sha": sha, "data": data})
+        with _lock:
+            # 送信中に次の保存が来ていたらジャーナルは残す（次の周回で送る）
+            latest = _gen.get(path, 0) == entry.get("gen")
+        if latest:
+            _remove_file(_journal_file(path))
+        with _lock:
+            if data == entry["data"]:
+                _base[path] = sha
+            elif latest:
+                # リモートの変更を取り込んだ版は、画面側が受け取るまで元の sha を変えない
+                _updates[path] = (data, sha)
+            if latest:
+                _dirty.discard(path)
+                _wakeup.notify_all()
+    return True
+
+
+def _reconcile(path: str, data: Dict[str, Any],
+               base_sha: Optional[str]) -> Optional[Tuple[Dict[str, Any], Optional[str]]]:
+    """今のリモートとこちらの変更を合わせた文書と、その元にしたリモートの sha。合わせられなければ None。"""
+    if _merge is None:
+        return None
+    remote, remote_sha = read_json_with_sha(path)
+    if remote is None:
+        return data, None  # リモートで消された: そのまま作り直す
+    cached = _read_file(_cache_file(path)) or {}
+    base = cached.get("data") if base_sha and cached.get("sha") == base_sha else None
+    return _merge(base, data, remote), remote_sha
+
+
+def _take_ready() -> str:
+    # _lock を持って呼ぶ。送れる path（送信中でもバックオフ中でもない）が出るまで待つ
+    while True:
+        now = time.monotonic()
+        waits = []
+        for path in _dirty:
+            if path in _inflight:
+                continue
+            at = _retry_at.get(path, 0.0)
+            if at <= now:
+                _inflight.add(path)
+                return path
+            waits.append(at - now)
+        _wakeup.wait(min(waits) if waits else None)
+
+
+def _writer_loop() -> None:
+    while True:
+        with _lock:
+            path = _take_ready()
+        try:
+            ok = _flush(path)
+        except Exception:
+            ok = False
+        with _lock:
+            _inflight.discard(path)
+            if ok:
+                _retry_at.pop(path, None)
+                _retry_delay.pop(path, None)
+            else:
+                # GitHub障害中はバックオフしつつ再送を続ける（ジャーナルは残っている）。待つのはこの path だけ
+                delay = min(_retry_delay.get(path, RETRY_MIN_SEC / 2) * 2, RETRY_MAX_SEC)
+                _retry_delay[path] = delay
+                _retry_at[path] = time.monotonic() + delay
+            _wakeup.notify_all()
+
+
+def start() -> None:
+    """書き込みスレッドを起動し、前回プロセスの未送信ジャーナルを再送キューに載せる。"""
+    metrics.start_exporter(METRICS_FILE)
+    with _lock:
+        if _writers:
+            return
+    entries = []
+    if os.path.isdir(JOURNAL_DIR):
+        for name in os.listdir(JOURNAL_DIR):
+            if name.endswith(".tmp"):
+                continue
+            entry = _read_file(os.path.join(JOURNAL_DIR, name))
+            if entry and entry.get("path"):
+                entries.append(entry)
+    with _lock:
+        if _writers:
+            return
+        for entry in entries:
+            _dirty.add(entry["path"])
+            _gen[entry["path"]] = max(_gen.get(entry["path"], 0), entry.get("gen", 0))
+            _base.setdefault(entry["path"], entry.get("base_sha"))
+        for i in range(WRITER_THREADS):
+            t = threading.Thread(target=_writer_loop, name=f"local_cache-writer-{i}", daemon=True)
+            t.start()
+            _writers.append(t)
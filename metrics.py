@@ -0,0 +1,137 @@
+# metrics.py
+# プロセス共通のメトリクス（カウンタ・ヒストグラム）。
+# Prometheus のテキスト形式でローカルファイルに書き出す（node_exporter の textfile collector で拾う想定）。
+import atexit
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+EXPORT_INTERVAL_SEC = 15.0
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_meta: Dict[str, Tuple[str, str, Sequence[float]]] = {}    # name -> (type, help, buckets)
+_counters: Dict[Tuple[str, _Labels], float] = {}
+_histograms: Dict[Tuple[str, _Labels], List[float]] = {}   # バケットごとの件数 + [sum, count]
+_exporter: Optional[threading.Thread] = None
+
+
+def describe(name: str, kind: str, help_text: str, buckets: Sequence[float] = ()) -> None:
+    """メトリクスを登録する（kind は "counter" か "histogram"）。"""
+    with _lock:
+        _meta[name] = (kind, help_text, tuple(buckets))
+
+
+def _labels(labels: Dict[str, object]) -> _Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels: object) -> None:
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def observe(name: str, value: float, **labels: object) -> None:
+    key = (name, _labels(labels))
+    with _lock:
+        buckets = _meta[name][2]
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0.0] * (len(buckets) + 2)
+        for i, le in enumerate(buckets):
+            if value <= le:
+                h[i] += 1
+                break
+        h[-2] += value
+        h[-1] += 1
+
+
+def value(name: str, **labels: object) -> float:
+    """カウンタの現在値（ラベルを省略したら全系列の合計）。"""
+    with _lock:
+        if labels:
+            return _counters.get((name, _labels(labels)), 0.0)
+        return sum(v for (n, _), v in _counters.items() if n == name)
+
+
+# =============================
+# 書き出し
+# =============================
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(labels: _Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _fmt_num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(v)
+
+
+def render() -> str:
+    """Prometheus のテキスト形式（0.0.4）"""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        meta = dict(_meta)
+
+    lines: List[str] = []
+    for name in sorted(meta):
+        kind, help_text, buckets = meta[name]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (n, labels), v in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_fmt_labels(labels)} {_fmt_num(v)}")
+            continue
+        for (n, labels), h in sorted(histograms.items()):
+            if n != name:
+                continue
+            cumulative = 0.0
+            for le, c in zip(buckets, h):
+                cumulative += c
+                lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', _fmt_num(le)),))} {_fmt_num(cumulative)}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {_fmt_num(h[-1])}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_num(h[-2])}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {_fmt_num(h[-1])}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str) -> None:
+    # 収集側が書きかけを読まないよう tmp に書いてから置き換える
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+def _export_loop(path: str, interval: float) -> None:
+    while True:
+        try:
+            write_textfile(path)
+        except OSError:
+            pass  # 書けなくても本体は止めない（次の周回で再試行）
+        time.sleep(interval)
+
+
+def start_exporter(path: str, interval: float = EXPORT_INTERVAL_SEC) -> None:
+    """path へ定期的に書き出すスレッドを起動する（プロセス終了時にも1回書く）。"""
+    global _exporter
+    with _lock:
+        if _exporter is not None:
+            return
+        _exporter = threading.Thread(target=_export_loop, args=(path, interval),
+                                     name="metrics-exporter", daemon=True)
+        _exporter.start()
+    atexit.register(write_textfile, path)
@@ -0,0 +1,50 @@
+# oplog.py
+# 操作ログ（取り消し / やり直し）
+from collections import deque
+from typing import Callable, List, NamedTuple, Optional
+
+UNDO_LIMIT = 100
+
+
+class Op(NamedTuple):
+    label: str
+    do: Callable[[], None]
+    undo: Callable[[], None]
+
+
+class OpLog:
+    """
+    変更ごとに「やる / 戻す」を記録する。戻すのは常に最後の操作からなので、
+    各操作は自分が記録した位置（末尾・インデックス）をそのまま使って O(1) で戻せる。
+    """
+
+    def __init__(self, limit: int = UNDO_LIMIT):
+        self._undo: deque = deque(maxlen=limit)
+        self._redo: List[Op] = []
+
+    def run(self, label: str, do: Callable[[], None], undo: Callable[[], None]) -> None:
+        do()
+        self._undo.append(Op(label, do, undo))
+        self._redo.clear()
+
+    def undo(self) -> Optional[str]:
+        if not self._undo:
+            return None
+        op = self._undo.pop()
+        op.undo()
+        self._redo.append(op)
+        return op.label
+
+    def redo(self) -> Optional[str]:
+        if not self._redo:
+            return None
+        op = self._redo.pop()
+        op.do()
+        self._undo.append(op)
+        return op.label
+
+    def last_undo(self) -> Optional[str]:
+        return self._undo[-1].label if self._undo else None
+
+    def last_redo(self) -> Optional[str]:
+        return self._redo[-1].label if self._redo else None
@@ -0,0 +1,67 @@
+# picker.py
+# デッキピッカーの候補選び（検索 / 最近・よく使う）
+# 1回の再描画で作るボタン数を上限で抑えるため、ここで候補を絞ってから描画する。
+import heapq
+import unicodedata
+from itertools import islice
+from typing import Any, Callable, Iterable, List, Mapping, Sequence, Tuple
+
+from ranking import Counters
+
+SEARCH_LIMIT = 12    # 検索結果として出すボタンの上限
+SHORTCUT_LIMIT = 6   # 「最近・よく使う」に出すボタンの上限
+RECENT_SCAN = 200    # 「最近」を探すときにさかのぼる試合数
+
+
+def normalize(s: str) -> str:
+    """全角/半角・大文字/小文字の違いを無視して比べるための正規化。"""
+    return unicodedata.normalize("NFKC", s or "").casefold()
+
+
+def search(decks: Iterable[Mapping[str, Any]], query: str, class_names: Mapping[str, str],
+           limit: int = SEARCH_LIMIT) -> Tuple[List[Mapping[str, Any]], int]:
+    """
+    空白区切りの語をすべて含むデッキ（名前かクラス名で一致）を返す。
+    前方一致を先に並べる。戻り値: (上位 limit 件, 該当件数)
+    """
+    terms = normalize(query).split()
+    if not terms:
+        return [], 0
+    hits = []
+    for d in decks:
+        name = normalize(d["name"])
+        text = name + " " + normalize(class_names.get(d["class"], ""))
+        if all(t in text for t in terms):
+            hits.append((not name.startswith(terms[0]), name, d))
+    top = heapq.nsmallest(limit, hits, key=lambda h: (h[0], h[1]))
+    return [h[2] for h in top], len(hits)
+
+
+def recent(matches: Sequence[Mapping[str, Any]], field: str, resolve: Callable[[Any], Any],
+           accept: Callable[[Any], bool], limit: int) -> List[Any]:
+    """直近の試合から重複なしで limit 件（matches は古い順）。"""
+    out: List[Any] = []
+    for m in islice(reversed(matches), RECENT_SCAN):
+        deck_id = resolve(m.get(field))
+        if deck_id is not None and deck_id not in out and accept(deck_id):
+            out.append(deck_id)
+            if len(out) >= limit:
+                break
+    return out
+
+
+def frequent(counters: Counters, accept: Callable[[Any], bool], limit: int,
+             exclude: Iterable[Any] = ()) -> List[Any]:
+    """試合数の多い順に limit 件（exclude に含まれるものは除く）。"""
+    skip = set(exclude)
+    items = ((t, k) for k, (_, t) in counters.items() if k not in skip and accept(k))
+    return [k for _, k in heapq.nlargest(limit, items, key=lambda x: x[0])]
+
+
+def shortcuts(matches: Sequence[Mapping[str, Any]], field: str, counters: Counters,
+              resolve: Callable[[Any], Any], accept: Callable[[Any], bool],
+              limit: int = SHORTCUT_LIMIT) -> List[Any]:
+    """「最近」を半分まで、残りを「よく使う」で埋める。"""
+    ids = recent(matches, field, resolve, accept, (limit + 1) // 2)
+    return ids + frequent(counters, accept, limit - len(ids), exclude=ids)
+
@@ -0,0 +1,92 @@
+# ranking.py
+import heapq
+import math
+from typing import Callable, Dict, Hashable, Iterable, List, Tuple
+
+# 95%信頼区間
+Z_95 = 1.96
+
+# ベイズ縮約の事前分布（勝率50%を PRIOR_STRENGTH 試合ぶん足す）
+PRIOR_MEAN = 0.5
+PRIOR_STRENGTH = 10.0
+
+# key -> [wins, total]
+Counters = Dict[Hashable, List[int]]
+
+
+def wilson_lower_bound(wins: int, total: int, z: float = Z_95) -> float:
+    """勝率の Wilson スコア区間の下限（0.0〜1.0）。試合数が少ないほど低く出る。"""
+    if total <= 0:
+        return 0.0
+    p = wins / total
+    z2 = z * z
+    denom = 1 + z2 / total
+    center = p + z2 / (2 * total)
+    margin = z * math.sqrt((p * (1 - p) + z2 / (4 * total)) / total)
+    return max(0.0, (center - margin) / denom)
+
+
+def bayesian_win_rate(wins: int, total: int,
+                      prior_mean: float = PRIOR_MEAN, prior_strength: float = PRIOR_STRENGTH) -> float:
+    """事前分布で縮約した勝率（0.0〜1.0）。"""
+    return (wins + prior_mean * prior_strength) / (total + prior_strength)
+
+
+SCORERS: Dict[str, Callable[[int, int], float]] = {
+    "wilson": wilson_lower_bound,
+    "bayes": bayesian_win_rate,
+}
+
+
+def count_by(matches: Iterable[dict], key: Callable[[dict], Hashable]) -> Counters:
+    """1パスで key ごとの [wins, total] を数える。"""
+    counters: Counters = {}
+    for m in matches:
+        k = key(m)
+        c = counters.get(k)
+        if c is None:
+            c = counters[k] = [0, 0]
+        if m["result"] == "win":
+            c[0] += 1
+        c[1] += 1
+    return counters
+
+
+def remap(counters: Counters, fn: Callable[[Hashable], Hashable]) -> Counters:
+    """key を付け替えて合算する（デッキ統合の解決など）。"""
+    out: Counters = {}
+    for key, (w, t) in counters.items():
+        c = out.setdefault(fn(key), [0, 0])
+        c[0] += w
+        c[1] += t
+    return out
+
+
+def top_k(counters: Counters, k: int = 3, scorer: str = "wilson",
+          min_matches: int = 1, worst: bool = False) -> List[Tuple[Hashable, int, int, float]]:
+    """
+    スコア上位 k 件を heap で選ぶ（全件ソートしない）。
+    worst=True なら負け側のスコア（＝苦手度）で選ぶ。負け越していないもの（勝率50%以上）は出さない。
+    戻り値: [(key, wins, total, score), ...]（スコア降順）
+    """
+    score = SCORERS[scorer]
+
+    def items():
+        for key, (w, t) in counters.items():
+            if t < min_matches or worst and 2 * w >= t:
+                continue
+            s = score(t - w, t) if worst else score(w, t)
+            yield key, w, t, s
+
+    # 同点は試合数の多い方を上に
+    return heapq.nlargest(k, items(), key=lambda r: (r[3], r[2]))
+
+
+def rank(counters: Counters, k: int = 3, scorer: str = "wilson",
+         min_matches: int = 3, worst: bool = False) -> List[Tuple[Hashable, int, int, float]]:
+    """少数試合でのブレを避けるため min_matches 以上を優先。該当なしならしきい値なしで選ぶ。"""
+    rows = top_k(counters, k, scorer, min_matches, worst)
+    if not rows and min_matches > 1:
+        rows = top_k(counters, k, scorer, 1, worst)
+    return rows
+
@@ -0,0 +1,183 @@
+# store.py
+# ユーザーデータ（tracker_*.json）の組み立てと読み書き。
+# app.py（UI）と loadtest.py（負荷試験）から同じ経路で使う。
+#
+# matches の並び: 文書（JSON）は新しい順、メモリ上は古い順（追加・取り消しが末尾で済むように）。
+# 変換は normalize_state（読み込み）と build_document（保存）でだけ行う。
+from datetime import datetime
+from typing import Any, Dict, List, MutableMapping, Optional
+
+import local_cache
+from decks import INITIAL_DECKS, SCHEMA_VERSION, DeckCatalog, migrate_state
+
+# ログイン時に読み込みを待つ秒数（ローカルキャッシュがあれば大抵この間に読み終わる。それ以上は待たずに先に描画する）
+LOAD_WAIT_SEC = 0.05
+# 読み終わるまで聞き直す間隔
+LOAD_POLL_SEC = 0.3
+
+
+def user_data_path(user_id: str, data_dir: str = "data") -> str:
+    return f"{data_dir.strip('/')}/tracker_{user_id}.json"
+
+
+# v2 以前の文書にだけある項目（移行で deck_overlay に置き換わる）
+LEGACY_KEYS = ["deck_types", "next_deck_id"]
+
+
+def default_state() -> Dict[str, Any]:
+    return {
+        "schema": SCHEMA_VERSION,
+        "deck_overlay": {},  # ベースカタログとの差分（DeckCatalog.to_overlay）
+        "my_deck": None,
+        "current_opponent": None,
+        "matches": [],  # my_deck_id・opponent_deck_id でデッキを参照
+        "stats_mydeck_filter": None,  # 集計対象（None=全体）
+    }
+
+
+def normalize_state(data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not data:
+        return default_state()
+
+    base = default_state()
+    base["schema"] = 1  # 旧形式は schema を持たない
+    for k in list(base.keys()) + LEGACY_KEYS:
+        if k in data:
+            base[k] = data[k]
+
+    if base["schema"] < 3 and not isinstance(base.get("deck_types"), list):
+        base["deck_types"] = [dict(d) for d in INITIAL_DECKS]
+    if not isinstance(base["deck_overlay"], dict):
+        base["deck_overlay"] = {}
+    if not isinstance(base["matches"], list):
+        base["matches"] = []
+    base = migrate_state(base)
+    base["matches"].reverse()  # 新しい順 → 古い順
+    return base
+
+
+def poll_state(path: str, wait: float = 0.0) -> Optional[Dict[str, Any]]:
+    """
+    読み込みを裏で始め、読み終わっていれば正規化した状態を返す（まだなら None）。
+    wait 秒までは待つ（ローカルキャッシュがあれば大抵これで間に合う）。404以外の失敗は ReadError。
+    """
+    local_cache.load_async(path)
+    done, data = local_cache.take_loaded(path, wait)
+    return normalize_state(data) if done else None
+
+
+def take_update(path: str) -> Optional[Dict[str, Any]]:
+    """裏の再検証・保存時の合わせ直しで届いたリモートの変更を、正規化した状態で返す（無ければ None）。"""
+    remote = local_cache.take_update(path)
+    return normalize_state(remote) if remote is not None else None
+
+
+def build_document(catalog: DeckCatalog, my_deck: Optional[int], current_opponent: Optional[int],
+                   matches: List[Dict[str, Any]], stats_mydeck_filter: Optional[int]) -> Dict[str, Any]:
+    # matches は最後に置く（読み込み側が小さいフィールドを先に受け取れるように）
+    return {
+        "schema": SCHEMA_VERSION,
+        "deck_overlay": catalog.to_overlay(),
+        "my_deck": my_deck,
+        "current_opponent": current_opponent,
+        "stats_mydeck_filter": stats_mydeck_filter,
+        "matches": matches[::-1],  # 古い順 → 新しい順（どのみち保存時に全件シリアライズする）
+    }
+
+
+def _pick(base: Dict[str, Any], local: Dict[str, Any], remote: Dict[str, Any], key: str) -> Any:
+    # こちらで変えていればこちら、そうでなければリモート
+    return local.get(key) if local.get(key) != base.get(key) else remote.get(key)
+
+
+def _merge_overlay(base: Dict[str, Any], local: Dict[str, Any], remote: Dict[str, Any]) -> Dict[str, Any]:
+    local_added = {d["id"]: d for d in local.get("added") or []}
+    base_added = {d["id"] for d in base.get("added") or []}
+    # リモートで追加されたデッキも残す（同じ id を両方で追加していたらこちらを優先）
+    added = list(local_added.values()) + [
+        d for d in remote.get("added") or [] if d["id"] not in local_added and d["id"] not in base_added]
+    patch = {}
+    for key in set(local.get("patch") or {}) | set(remote.get("patch") or {}) | set(base.get("patch") or {}):
+        v = _pick(base.get("patch") or {}, local.get("patch") or {}, remote.get("patch") or {}, key)
+        if v:
+            patch[key] = v
+    return {
+        "base_version": local.get("base_version", remote.get("base_version")),
+        "added": sorted(added, key=lambda d: d["id"]),
+        "patch": patch,
+        "next_id": max(local.get("next_id") or 0, remote.get("next_id") or 0),
+    }
+
+
+def merge_documents(base: Optional[Dict[str, Any]], local: Dict[str, Any],
+                    remote: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    保存が競合したとき、こちらの変更をリモートの今の文書に重ねる（local_cache から呼ばれる）。
+    base は両者の元の文書（分からなければ None。そのときは戦績の削除を判別できず、両方の和になる）。
+    戦績は id 単位で足し引きし、それ以外の項目はこちらで変えたものだけこちらを使う。
+    """
+    b = normalize_state(base)  # None なら空の文書（どちらの戦績・デッキも「追加」扱い）
+    mine, theirs = normalize_state(local), normalize_state(remote)
+
+    base_ids = {m.get("id") for m in b["matches"]}
+    mine_by_id = {m.get("id"): m for m in mine["matches"]}
+    theirs_ids = {m.get("id") for m in theirs["matches"]}
+    matches = [mine_by_id.get(m.get("id"), m) for m in theirs["matches"]
+               # base にあってこちらに無い = こちらで消した
+               if m.get("id") in mine_by_id or m.get("id") not in base_ids]
+    matches += [m for m in mine["matches"] if m.get("id") not in theirs_ids and m.get("id") not in base_ids]
+    matches.sort(key=lambda m: m.get("id") or 0)
+
+    return {
+        "schema": SCHEMA_VERSION,
+        "deck_overlay": _merge_overlay(b["deck_overlay"], mine["deck_overlay"], theirs["deck_overlay"]),
+        **{k: _pick(b, mine, theirs, k) for k in ("my_deck", "current_opponent", "stats_mydeck_filter")},
+        "matches": matches[::-1],
+    }
+
+
+local_cache.set_merge(merge_documents)
+
+
+def save_state(path: str, doc: Dict[str, Any], user_id: str) -> None:
+    # ジャーナルに書いて即戻る（GitHubへは裏で送る）
+    local_cache.save(path, doc, message=f"Update tracker for {user_id}")
+
+
+def new_match(my_deck_id: int, opponent_deck_id: int, result: str) -> Dict[str, Any]:
+    now = datetime.now()
+    return {
+        "id": int(now.timestamp() * 1000),
+        "my_deck_id": my_deck_id,
+        "opponent_deck_id": opponent_deck_id,
+        "result": result,  # win/loss
+        "timestamp": now.isoformat(timespec="seconds"),
+    }
+
+
+# =============================
+# 画面の状態に対する操作（app.py と loadtest.py で同じ手順を使う）
+# state は st.session_state か、同じキーを持つ dict
+# =============================
+def apply_state(state: MutableMapping[str, Any], data: Dict[str, Any]) -> None:
+    """normalize_state の結果を state に載せる。"""
+    state["catalog"] = DeckCatalog(data["deck_overlay"])
+    state["my_deck"] = data["my_deck"]
+    state["current_opponent"] = data["current_opponent"]
+    state["matches"] = data["matches"]
+    state["stats_mydeck_filter"] = data.get("stats_mydeck_filter")
+
+
+def add_match(state: MutableMapping[str, Any], match: Dict[str, Any]) -> None:
+    """new_match で作った試合を末尾に追加し、次の記録に備えて対戦相手を外す。"""
+    state["matches"].append(match)
+    state["current_opponent"] = None
+
+
+def state_document(state: MutableMapping[str, Any]) -> Dict[str, Any]:
+    return build_document(state["catalog"], state["my_deck"], state["current_opponent"],
+                          state["matches"], state["stats_mydeck_filter"])
+
+
+def save(state: MutableMapping[str, Any], path: str, user_id: str) -> None:
+    save_state(path, state_document(state), user_id)
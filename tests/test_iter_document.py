@@ -0,0 +1,41 @@
+# iter_document: 受け取りながら計算する blob sha が本文全体のものになること。
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import github_kv  # noqa: E402
+
+
+class _Response(io.BytesIO):
+    def __init__(self, raw: bytes):
+        super().__init__(raw)
+        self.status = 200
+        self.headers = {"Content-Length": str(len(raw))}
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    for key in ("GITHUB_TOKEN", "GITHUB_OWNER", "GITHUB_REPO", "GITHUB_BRANCH", "GITHUB_DATA_DIR"):
+        monkeypatch.setenv(key, "test")
+
+    def _serve(raw: bytes):
+        monkeypatch.setattr(github_kv, "_open", lambda *a, **kw: _Response(raw))
+    return _serve
+
+
+@pytest.mark.parametrize("size", [10, github_kv.STREAM_CHUNK_BYTES - 1, github_kv.STREAM_CHUNK_BYTES,
+                                  2 * github_kv.STREAM_CHUNK_BYTES])
+def test_sha_covers_trailing_bytes(serve, size):
+    # size バイトの JSON オブジェクト + 改行（パーサは "}" までしか読まない）
+    pad = size - len(b'{"a": ""}')
+    raw = json.dumps({"a": "x" * pad}, separators=(", ", ": ")).encode() + b"\n"
+    assert len(raw) == size + 1
+    serve(raw)
+    data, sha = github_kv.read_json_with_sha("data/tracker_test.json")
+    assert data == json.loads(raw)
+    assert sha == github_kv.git_blob_sha(raw)
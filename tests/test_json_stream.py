@@ -0,0 +1,92 @@
+# _JsonStream（github_kv の逐次 JSON パーサ）を json.loads と突き合わせる。
+# チャンクの境目がどこに来ても同じ結果になること（特に数値・エスケープ・マルチバイト文字）。
+import io
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from github_kv import _JsonStream  # noqa: E402
+
+
+class _ChunkedReader(io.RawIOBase):
+    """read(n) を無視して chunk バイトずつ返す（短い読み込みを再現する）。"""
+
+    def __init__(self, raw: bytes, chunk: int):
+        self._raw = raw
+        self._chunk = chunk
+        self._pos = 0
+
+    def read(self, n: int = -1) -> bytes:
+        out = self._raw[self._pos:self._pos + self._chunk]
+        self._pos += len(out)
+        return out
+
+
+def _collect(raw: bytes, chunk: int):
+    data = {}
+    for kind, key, value in _JsonStream(_ChunkedReader(raw, chunk)).events():
+        if kind == "field":
+            data[key] = value
+        else:
+            data[key].append(value)
+    return data
+
+
+def _number(rng: random.Random):
+    return rng.choice([
+        0, -1, 7, 10 ** 12, rng.randint(-10 ** 6, 10 ** 6),
+        0.5, -0.25, 1e-7, 3.0e21, 1.5e300, rng.uniform(-1e6, 1e6),
+    ])
+
+
+def _scalar(rng: random.Random):
+    return rng.choice([
+        _number(rng), _number(rng), True, False, None,
+        "", "リノE", "a\"b\\c\n", "é\U0001f600", "x" * rng.randint(1, 40),
+    ])
+
+
+def _value(rng: random.Random, depth: int = 0):
+    r = rng.random()
+    if depth < 2 and r < 0.15:
+        return [_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    if depth < 2 and r < 0.3:
+        return {f"k{i}": _value(rng, depth + 1) for i in range(rng.randint(0, 4))}
+    return _scalar(rng)
+
+
+def _document(rng: random.Random):
+    doc = {f"f{i}": _value(rng) for i in range(rng.randint(0, 5))}
+    doc["matches"] = [{"id": _number(rng), "v": _value(rng)} for _ in range(rng.randint(0, 8))]
+    if rng.random() < 0.5:
+        doc["nums"] = [_number(rng) for _ in range(rng.randint(1, 10))]
+    return doc
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_matches_json_loads_for_any_chunk_size(seed):
+    rng = random.Random(seed)
+    doc = _document(rng)
+    indent = rng.choice([None, 2])
+    raw = json.dumps(doc, ensure_ascii=rng.random() < 0.5, indent=indent).encode("utf-8")
+    expected = json.loads(raw)
+    for chunk in list(range(1, 12)) + [rng.randint(12, 64), len(raw)]:
+        assert _collect(raw, chunk) == expected, (chunk, raw)
+
+
+@pytest.mark.parametrize("text", ['{"a": 0.5}', '{"a": 1e5}', '{"a": -12.75e-3}', '{"a": [1.0, 2e1]}'])
+def test_number_split_at_every_position(text):
+    raw = text.encode("utf-8")
+    for chunk in range(1, len(raw) + 1):
+        assert _collect(raw, chunk) == json.loads(raw)
+
+
+@pytest.mark.parametrize("text", ['{"a": 1e}', '{"a": 0.}', '{"a": 1', '{"a": 1x}'])
+def test_truncated_or_broken_number_raises(text):
+    with pytest.raises(ValueError):
+        _collect(text.encode("utf-8"), 3)